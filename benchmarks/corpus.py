@@ -0,0 +1,73 @@
+'''Benchmark corpora of DnDBehindTheScreen-style post bodies.
+
+load_corpus() reads the hand-written posts checked in under corpus/.
+make_corpus() generates any number of posts; the same seed always
+yields the same posts, so numbers from different runs and different
+commits can be compared directly.
+'''
+import glob
+import io
+import os
+import random
+
+_corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+_words = ("ancient cursed gilded rusty whispering broken silver hollow"
+          " sunken crimson forgotten merchant caravan goblin dragon tavern"
+          " ring sword lantern map cloak idol scroll key bridge shrine").split()
+
+
+def _phrase(rng, n=6):
+    return " ".join(rng.choice(_words) for _ in range(n)).capitalize()
+
+
+def _table(rng, die, ranged=False):
+    lines = ["**d{} {}**".format(die, _phrase(rng, 3)), ""]
+    if ranged:
+        start = 1
+        while start <= die:
+            stop = min(die, start + rng.randint(0, 4))
+            if stop == start:
+                lines.append("{}. {}".format(start, _phrase(rng)))
+            else:
+                lines.append("{}-{}. {}".format(start, stop, _phrase(rng)))
+            start = stop + 1
+    else:
+        for i in range(1, die + 1):
+            lines.append("{}. {}".format(i, _phrase(rng)))
+    return lines
+
+
+def _inline_row(rng, i):
+    return "{}. {} (d3 1 {} 2 {} 3 {})".format(
+        i, _phrase(rng, 3), _phrase(rng, 2), _phrase(rng, 2), _phrase(rng, 2))
+
+
+def make_post(rng, tables=6):
+    lines = [_phrase(rng, 20), ""]
+    for _ in range(tables):
+        kind = rng.random()
+        if kind < 0.4:
+            lines.extend(_table(rng, 100, ranged=True))
+        elif kind < 0.7:
+            lines.extend(_table(rng, rng.choice([4, 6, 8, 10, 12, 20])))
+        else:
+            lines.append("**d6 {}**".format(_phrase(rng, 3)))
+            lines.extend(_inline_row(rng, i) for i in range(1, 7))
+        lines.extend(["", _phrase(rng, 12), ""])
+    return "\n".join(lines)
+
+
+def make_corpus(posts=200, tables=6, seed=4242):
+    rng = random.Random(seed)
+    return [make_post(rng, tables) for _ in range(posts)]
+
+
+def load_corpus(corpus_dir=_corpus_dir):
+    '''{name: post body} for every .md file in corpus_dir'''
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.md'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with io.open(path, encoding='utf8') as f:
+            corpus[name] = f.read()
+    return corpus
@@ -0,0 +1,303 @@
+'''A local stand-in for the parts of the Reddit API the bot touches.
+
+FakeReddit serves benchmark posts, their comment trees and an inbox
+through objects that subclass the real praw models, so get_post_text
+and friends treat them as the real thing.  Every call that would hit
+the network sleeps for latency seconds and is counted in
+FakeReddit.calls; with error_rate set, that fraction of calls raises
+FakeServerError instead, the prawcore.ServerError of a real 503.
+Replies the bot posts are recorded in FakeReddit.replies.
+
+make_reddit() builds a subreddit from benchmarks.corpus; load_reddit()
+replays a recorded JSON-lines archive in the format ingest.py reads.
+'''
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+import praw
+import prawcore
+
+from benchmarks.corpus import make_corpus
+
+_page_size = 100
+_mark_read_batch = 25
+
+
+class FakeResponse(object):
+    status_code = 503
+
+
+class FakeServerError(prawcore.ServerError):
+    '''Raised by an injected failure'''
+    def __init__(self, message):
+        super(FakeServerError, self).__init__(FakeResponse())
+        self.args = (message,)
+
+
+class FakeSubmission(praw.models.Submission):
+    def __init__(self, reddit, id, selftext, created_utc, comment_bodies=()):
+        self.__dict__.update(
+            _reddit=reddit,
+            _fetched=True,
+            _comments=[],
+            _comments_fetched=False,
+            id=id,
+            title='Post {}'.format(id),
+            url='https://www.reddit.com/r/DnDBehindTheScreen/comments/{}/'.format(id),
+            selftext=selftext,
+            author='author_{}'.format(id),
+            edited=False,
+            created_utc=created_utc,
+        )
+        for i, body in enumerate(comment_bodies):
+            self.add_comment('{}c{}'.format(id, i), body)
+
+    @property
+    def fullname(self):
+        return 't3_' + self.id
+
+    @property
+    def comments(self):
+        '''The whole comment tree, fetched by one counted call'''
+        if not self._comments_fetched:
+            self._reddit.call('comments')
+            self._comments_fetched = True
+        return self._comments
+
+    def add_comment(self, id, body, parent=None, author=None):
+        '''Adds a comment, top-level or under parent, without a call'''
+        comment = FakeComment(self._reddit, id, body, self, author)
+        (parent._replies if parent is not None else self._comments).append(comment)
+        self._reddit._comments_by_id[id] = comment
+        return comment
+
+
+class FakeComment(praw.models.Comment):
+    def __init__(self, reddit, id, body, submission, author=None):
+        self.__dict__.update(
+            _reddit=reddit,
+            _fetched=True,
+            _submission=submission,
+            _replies=[],
+            id=id,
+            body=body,
+            author=author or 'commenter_{}'.format(id),
+            score=1,
+            permalink=submission.url + id,
+            edited=False,
+            created_utc=submission.created_utc,
+        )
+
+    @property
+    def fullname(self):
+        return 't1_' + self.id
+
+    @property
+    def submission(self):
+        return self._submission
+
+    @property
+    def replies(self):
+        return self._replies
+
+    def reply(self, body):
+        self._reddit.call('reply')
+        reply = self._submission.add_comment(
+            'r{}'.format(len(self._reddit.replies)), body, self, 'TableGenie')
+        self._reddit.record_reply(self, body)
+        return reply
+
+
+class FakeMessage(praw.models.Message):
+    def __init__(self, reddit, id, body, author):
+        self.__dict__.update(
+            _reddit=reddit,
+            _fetched=True,
+            id=id,
+            body=body,
+            author=author,
+            subject='Tables',
+        )
+
+    @property
+    def fullname(self):
+        return 't4_' + self.id
+
+    def reply(self, body):
+        self._reddit.call('reply')
+        self._reddit.record_reply(self, body)
+        return FakeMessage(self._reddit, 'r' + self.id, body, 'TableGenie')
+
+
+class FakeSubreddit(object):
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.display_name = name
+
+    def new(self, limit=100, params=None):
+        '''Newest first, one counted call per page of 100.  Honours the
+        'before' param: only posts newer than that fullname, up to the
+        limit nearest to it, as reddit returns them.'''
+        posts = self.reddit.posts
+        before = (params or {}).get('before')
+        if before:
+            fullnames = [post.fullname for post in posts]
+            newer = fullnames.index(before) if before in fullnames else 0
+            posts = posts[max(0, newer - limit):newer]
+        posts = posts[:limit]
+        # An empty listing still costs the call that finds it empty
+        for start in range(0, max(len(posts), 1), _page_size):
+            self.reddit.call('listing')
+            for post in posts[start:start + _page_size]:
+                yield post
+
+
+class FakeInbox(object):
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.items = []
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        with self._lock:
+            self.items.append(item)
+        return item
+
+    def unread(self, mark_read=False, limit=None):
+        '''Unread items, one counted call per page of 100'''
+        with self._lock:
+            items = list(self.items[:limit] if limit else self.items)
+        for start in range(0, max(len(items), 1), _page_size):
+            self.reddit.call('inbox')
+            for item in items[start:start + _page_size]:
+                yield item
+
+    def mark_read(self, items):
+        '''One counted call per 25 items, as praw batches them'''
+        items = list(items)
+        for start in range(0, len(items), _mark_read_batch):
+            self.reddit.call('mark_read')
+            read = set(id(item) for item in items[start:start + _mark_read_batch])
+            with self._lock:
+                self.items = [item for item in self.items if id(item) not in read]
+
+
+class FakeReddit(object):
+    read_only = True
+
+    def __init__(self, bodies, latency=0.02, comments_per_post=3, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.replies = []
+        self.inbox = FakeInbox(self)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._comments_by_id = {}
+        count = len(bodies)
+        self.posts = [
+            FakeSubmission(self, 'p{:05d}'.format(i), body,
+                           created_utc=1.5e9 + count - i,
+                           comment_bodies=['Comment {} on p{:05d}'.format(j, i)
+                                           for j in range(comments_per_post)])
+            for i, body in enumerate(bodies)]
+        self._by_id = dict((post.id, post) for post in self.posts)
+
+    def call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.calls['errors'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise FakeServerError('injected failure in {}'.format(name))
+
+    def record_reply(self, parent, body):
+        with self._lock:
+            self.replies.append((time.time(), parent.fullname, body))
+
+    def post(self, body, comment_bodies=()):
+        '''Adds a submission newer than every existing one'''
+        newest = self.posts[0].created_utc if self.posts else 1.5e9
+        item = FakeSubmission(self, 'n{:05d}'.format(len(self.posts)), body,
+                              newest + 1, comment_bodies)
+        self.posts.insert(0, item)
+        self._by_id[item.id] = item
+        return item
+
+    def mention(self, post, body='u/roll_one_for_me please', author='summoner'):
+        '''A comment on post summoning the bot, delivered to the inbox'''
+        comment = post.add_comment('m{}'.format(len(self._comments_by_id)), body,
+                                   author=author)
+        return self.inbox.add(comment)
+
+    def message(self, body, author='messenger'):
+        '''A private message to the bot, delivered to the inbox'''
+        return self.inbox.add(FakeMessage(self, 'pm{}'.format(len(self.inbox.items)),
+                                          body, author))
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def get(self, path, params=None):
+        '''One page of a subreddit's new listing, for a path such as
+        r/<name>/new, as a list'''
+        name = path.strip('/').split('/')[1]
+        params = params or {}
+        return list(self.subreddit(name).new(limit=params.get('limit', 100), params=params))
+
+    def submission(self, id=None):
+        self.call('submission')
+        return self._by_id[id]
+
+    def comment(self, id=None):
+        self.call('comment')
+        return self._comments_by_id[id]
+
+    def info(self, fullnames):
+        '''Known submissions and comments among fullnames, one call per
+        100'''
+        for start in range(0, len(fullnames), 100):
+            self.call('info')
+            for fullname in fullnames[start:start + 100]:
+                kind, _, id = fullname.partition('_')
+                item = (self._by_id if kind == 't3' else self._comments_by_id).get(id)
+                if item is not None:
+                    yield item
+
+
+def make_reddit(posts=100, latency=0.02, seed=4242, error_rate=0.0):
+    return FakeReddit(make_corpus(posts, seed=seed), latency,
+                      error_rate=error_rate, seed=seed)
+
+
+def load_reddit(path, latency=0.02, error_rate=0.0):
+    '''FakeReddit serving a recorded archive: JSON lines of submissions
+    (with selftext) and comments (with body, link_id and parent_id)'''
+    submissions = []
+    comments = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            (submissions if 'selftext' in record else comments).append(record)
+    submissions.sort(key=lambda s: -float(s.get('created_utc') or 0))
+    reddit = FakeReddit([], latency, error_rate=error_rate)
+    for record in submissions:
+        post = FakeSubmission(reddit, record['id'], record['selftext'],
+                              float(record.get('created_utc') or 0))
+        reddit.posts.append(post)
+        reddit._by_id[post.id] = post
+    # Parents come before their replies in reddit's own dumps
+    for record in comments:
+        post = reddit._by_id.get(record.get('link_id', '')[3:])
+        if post is None:
+            continue
+        parent_id = record.get('parent_id', '')
+        parent = reddit._comments_by_id.get(parent_id[3:]) if parent_id.startswith('t1_') else None
+        post.add_comment(record['id'], record['body'], parent, record.get('author'))
+    return reddit
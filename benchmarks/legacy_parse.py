@@ -0,0 +1,107 @@
+'''The pre-tokenizer parse path, kept only as the "before" side of
+benchmarks.parse.  It scans the text once per class, with uncompiled
+patterns and a strip(_trash) per line at each level, exactly as
+TableSource, Table, TableItem and InlineTable did before
+parse_tables().  Nothing here comes from the new parser but the
+pattern strings, so the two sides of the benchmark share no code.
+'''
+import re
+
+from tables import _trash, _header_regex, _line_regex
+from utils import lprint
+
+
+def legacy_parse(text):
+    indices = []
+    lines = text.split("\n")
+    for line_num in range(len(lines)):
+        if re.search(_header_regex, lines[line_num].strip(_trash)):
+            indices.append(line_num)
+    if len(indices) == 0:
+        return []
+    table_text = []
+    for i in range(len(indices) - 1):
+        table_text.append("\n".join(lines[indices[i]:indices[i+1]]))
+    table_text.append("\n".join(lines[indices[-1]:]))
+    return [LegacyTable(t) for t in table_text]
+
+
+class LegacyTable(object):
+    def __init__(self, text):
+        self.text = text
+        self.die = None
+        self.header = ""
+        lines = text.split('\n')
+        head_match = re.search(_header_regex, lines.pop(0).strip(_trash))
+        if head_match:
+            self.die = int(head_match.group(2))
+            self.header = head_match.group(3)
+        self.outcomes = [LegacyTableItem(l) for l in lines
+                         if re.search(_line_regex, l.strip(_trash))]
+
+
+class LegacyTableItem(object):
+    def __init__(self, text, w=0):
+        self.text = text
+        self.inline_table = None
+        self.outcome = ""
+        self.weight = 0
+        main_regex = re.search(_line_regex, text.strip(_trash))
+        if not main_regex:
+            return
+        self.outcome = main_regex.group(3).strip(_trash)
+        if not main_regex.group(2):
+            self.weight = 1
+        else:
+            try:
+                start = int(main_regex.group(1).strip(_trash))
+                stop = int(main_regex.group(2).strip(_trash))
+                self.weight = stop - start + 1
+            except:
+                self.weight = 1
+        if re.search("[dD]\d+", self.outcome):
+            die_regex = re.search("[dD]\d+", self.outcome)
+            try:
+                self.inline_table = LegacyInlineTable(self.outcome[die_regex.start():])
+            except RuntimeError as e:
+                lprint("Error in inline_table parsing ; table item full text:")
+                lprint(self.text)
+                lprint(e)
+                self.outcome = self.outcome[:die_regex.start()].strip(_trash)
+        self.outcome = self.outcome.strip(_trash)
+        if w:
+            self.weight = w
+
+
+class LegacyInlineTable(object):
+    def __init__(self, text):
+        self.text = text
+        self.die = None
+        self.header = ""
+        self.outcomes = []
+        self.is_inline = True
+        top = re.search("[dD](\d+)(.*)", self.text)
+        if not top:
+            return
+        self.die = int(top.group(1))
+        tail = top.group(2)
+        while tail:
+            in_match = re.search(_line_regex, tail.strip(_trash))
+            if not in_match:
+                lprint("Could not complete parsing InlineTable; in_match did not catch.")
+                lprint("Returning blank roll area.")
+                self.outcomes = [LegacyTableItem("1-{}. N/A".format(self.die))]
+                return
+            this_out = in_match.group(3)
+            next_match = re.search(_line_regex[1:], this_out)
+            if next_match:
+                tail = this_out[next_match.start():]
+                this_out = this_out[:next_match.start()]
+            else:
+                tail = ""
+            TI_text = in_match.group(1) + (in_match.group(2) if in_match.group(2) else "") + this_out
+            try:
+                self.outcomes.append(LegacyTableItem(TI_text))
+            except Exception as e:
+                lprint("Error building TableItem in inline table; item skipped.")
+                lprint("Exception:", e)
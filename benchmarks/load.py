@@ -0,0 +1,274 @@
+'''End-to-end load test of the Lambda handler and the mail loop against
+FakeReddit.
+
+    python -m benchmarks.load [--scenario lambda|mail|scan|all]
+                              [--concurrency N] [--invocations N] [--mail N]
+                              [--posts N] [--latency SECONDS]
+                              [--error-rate P] [--seed N] [--output FILE]
+
+lambda: --invocations events, a seeded mix of single lookups, top-3
+searches and seeded batches, are dealt to --concurrency worker
+processes, each a cold container with its own FakeReddit and table
+store, taking the next event whenever it is free.
+
+mail: --mail summonses and private messages linking table posts wait
+in the inbox; process_mail passes run until it is empty.  An item's
+latency runs from the start of the pass that took it to its first
+reply.
+
+scan: one scan_submissions pass over the fake subreddit.
+
+Prints one JSON document with throughput, p50 and p99 latency, failures
+and the API calls made, by kind; injected failures are counted under
+calls.errors.  The same seed always sends the same load.
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.fake_reddit import make_reddit
+from benchmarks.corpus import _words
+
+# Upper bound on process_mail passes before giving up on an inbox
+_max_mail_passes = 50
+
+_container = {}
+
+
+class Context(object):
+    '''The part of Lambda's context object the handler uses'''
+    def __init__(self, seconds=30):
+        self.deadline = time.time() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def percentile(values, q):
+    '''Nearest-rank q-th percentile of values, or None if empty'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+
+def summary(elapsed, latencies, count, failures, calls):
+    p50 = percentile(latencies, 50)
+    p99 = percentile(latencies, 99)
+    return dict(
+        count=count,
+        failures=failures,
+        elapsed_s=elapsed,
+        per_s=count / elapsed if elapsed else None,
+        p50_ms=p50 * 1e3 if p50 is not None else None,
+        p99_ms=p99 * 1e3 if p99 is not None else None,
+        calls=dict(calls),
+    )
+
+
+def make_events(count, posts, seed):
+    '''count Lambda events: lookups, top-3 searches and batches, some
+    naming a post by sub_id'''
+    rng = random.Random(seed)
+
+    def term():
+        return " ".join(rng.sample(_words, rng.choice([1, 2])))
+
+    def sub_id():
+        return 'p{:05d}'.format(rng.randrange(posts)) if rng.random() < 0.2 else None
+
+    events = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            params = dict(search_term=term())
+        elif kind < 0.8:
+            params = dict(search_term=term(), top=3)
+        else:
+            params = dict(seed=rng.randrange(2 ** 32), queries=[
+                dict(search_term=term(), sub_id=sub_id(), top=2, rolls=2)
+                for _ in range(rng.randint(2, 8))])
+        named = sub_id()
+        if named and 'search_term' in params:
+            params['sub_id'] = named
+        events.append(dict(params=params))
+    return events
+
+
+def start_container(posts, latency, error_rate, seed, store_dir):
+    '''Pool initializer: one cold Lambda container per worker process'''
+    sys.stdout = open(os.devnull, 'w')
+    os.environ['TABLE_STORE'] = os.path.join(
+        store_dir, 'store-{}.sqlite'.format(os.getpid()))
+    import roll_one
+    reddit = make_reddit(posts, latency, seed, error_rate)
+    roll_one.sign_in = lambda: reddit
+    _container['reddit'] = reddit
+
+
+def invoke(event):
+    '''(latency, failed, API calls) of one handler invocation'''
+    import lambda_entry
+    reddit = _container['reddit']
+    before = Counter(reddit.calls)
+    start = time.time()
+    try:
+        failed = lambda_entry.lambda_handler(event, Context())['statusCode'] != '200'
+    except Exception:
+        failed = True
+    elapsed = time.time() - start
+    calls = Counter(reddit.calls)
+    calls.subtract(before)
+    return elapsed, failed, dict(calls)
+
+
+def run_lambda(args):
+    events = make_events(args.invocations, args.posts, args.seed)
+    store_dir = tempfile.mkdtemp()
+    pool = multiprocessing.Pool(
+        args.concurrency, start_container,
+        (args.posts, args.latency, args.error_rate, args.seed, store_dir))
+    try:
+        start = time.time()
+        results = list(pool.imap_unordered(invoke, events, 1))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(store_dir, ignore_errors=True)
+    calls = Counter()
+    for _, _, invocation_calls in results:
+        calls.update(invocation_calls)
+    result = summary(elapsed, [latency for latency, _, _ in results], len(results),
+                     sum(1 for _, failed, _ in results if failed), calls)
+    result['concurrency'] = args.concurrency
+    return result
+
+
+def fill_inbox(reddit, count, seed):
+    '''count mail items: two in three summon the bot under a post, the
+    rest are PMs linking one to three posts'''
+    rng = random.Random(seed)
+    link = '[{}](https://www.reddit.com/r/DnDBehindTheScreen/comments/{}/)'
+    for i in range(count):
+        if rng.random() < 2 / 3.0:
+            reddit.mention(rng.choice(reddit.posts), author='summoner_{}'.format(i))
+        else:
+            reddit.message(" ".join(link.format(_words[n], post.id) for n, post in
+                                    enumerate(rng.sample(reddit.posts, rng.randint(1, 3)))),
+                           author='messenger_{}'.format(i))
+
+
+def run_mail(args):
+    import roll_one
+    reddit = make_reddit(args.posts, args.latency, args.seed, args.error_rate)
+    fill_inbox(reddit, args.mail, args.seed)
+    queued = [item.fullname for item in reddit.inbox.items]
+    log_dir, roll_one._log_dir = roll_one._log_dir, tempfile.mkdtemp()
+    taken = {}
+    failed_passes = 0
+    try:
+        start = time.time()
+        for _ in range(_max_mail_passes):
+            if not reddit.inbox.items:
+                break
+            pass_start = time.time()
+            for item in reddit.inbox.items:
+                taken.setdefault(item.fullname, pass_start)
+            try:
+                roll_one.process_mail(reddit)
+            except Exception:
+                failed_passes += 1
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(roll_one._log_dir, ignore_errors=True)
+        roll_one._log_dir = log_dir
+    answered = {}
+    for when, parent, _ in reddit.replies:
+        if parent in taken and parent not in answered:
+            answered[parent] = when - taken[parent]
+    result = summary(elapsed, list(answered.values()), len(queued),
+                     len(queued) - len(answered), reddit.calls)
+    result['failed_passes'] = failed_passes
+    result['unread'] = len(reddit.inbox.items)
+    return result
+
+
+def run_scan(args):
+    import roll_one
+    from scan_state import ScanState
+    reddit = make_reddit(args.posts, args.latency, args.seed, args.error_rate)
+    state_dir = tempfile.mkdtemp()
+    failures = 0
+    try:
+        start = time.time()
+        try:
+            roll_one.scan_submissions(
+                ScanState(os.path.join(state_dir, 'scan_state.json')), reddit, '')
+        except Exception:
+            failures = 1
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return summary(elapsed, [], args.posts, failures, reddit.calls)
+
+
+_scenarios = {'lambda': run_lambda, 'mail': run_mail, 'scan': run_scan}
+
+
+def run(args):
+    '''Results of the chosen scenarios; lprint chatter is discarded
+    meanwhile'''
+    names = ['lambda', 'mail', 'scan'] if args.scenario == 'all' else [args.scenario]
+    results = dict(
+        python=platform.python_version(),
+        posts=args.posts,
+        latency_s=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for name in names:
+            results[name] = _scenarios[name](args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenario', default='all',
+                        choices=['lambda', 'mail', 'scan', 'all'])
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--invocations', type=int, default=100)
+    parser.add_argument('--mail', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=4242)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+'''Memory held per 10k parsed tables, before and after __slots__.
+
+    python -m benchmarks.memory [--tables N]
+
+"before" is benchmarks.legacy_parse, whose objects carry a __dict__
+and their own copies of the raw table and line text; "after" is
+tables.parse_tables.  Post bodies are generated inside the measured
+region and then dropped, so whatever a representation keeps alive of
+them is counted.  Needs tracemalloc (Python 3).
+'''
+from __future__ import print_function
+
+import argparse
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from tables import parse_tables
+from benchmarks.corpus import make_corpus
+from benchmarks.legacy_parse import legacy_parse
+
+# make_corpus posts hold six tables each
+_tables_per_post = 6
+
+
+def held_bytes(parse, posts):
+    gc.collect()
+    tracemalloc.start()
+    tables = [t for text in make_corpus(posts) for t in parse(text)]
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, len(tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tables', type=int, default=10000)
+    args = parser.parse_args()
+    if tracemalloc is None:
+        raise SystemExit("benchmarks.memory needs tracemalloc (Python 3).")
+
+    posts = max(1, args.tables // _tables_per_post)
+    results = {}
+    for name, parse in (("before", legacy_parse), ("after", parse_tables)):
+        held, count = held_bytes(parse, posts)
+        results[name] = held * 10000.0 / count
+        print("{:>6}: {:6.1f} MB per 10k tables ({} tables measured)".format(
+            name, results[name] / 1e6, count))
+    print("saved: {:.0%}".format(1 - results["after"] / results["before"]))
+
+
+if __name__ == "__main__":
+    main()
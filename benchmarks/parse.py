@@ -0,0 +1,57 @@
+'''Before/after parse throughput on the fixed corpus.
+
+    python -m benchmarks.parse [--posts N] [--repeat N]
+
+"before" is benchmarks.legacy_parse, the old per-class scan; "after"
+is tables.parse_tables.  Both parse the same post bodies, and the
+table and item counts are checked to agree before timing.
+'''
+from __future__ import print_function
+
+import argparse
+import time
+
+from tables import parse_tables
+from benchmarks.corpus import make_corpus
+from benchmarks.legacy_parse import legacy_parse
+
+
+def _shape(tables):
+    return [(t.die, t.header, [(i.outcome, i.weight) for i in t.outcomes])
+            for t in tables]
+
+
+def best_time(parse, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for text in corpus:
+            parse(text)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.posts)
+    for text in corpus:
+        if _shape(legacy_parse(text)) != _shape(parse_tables(text)):
+            raise SystemExit("Parsers disagree; refusing to benchmark.")
+    size = sum(len(text) for text in corpus) / 1e6
+    tables = sum(len(parse_tables(text)) for text in corpus)
+    print("corpus: {} posts, {} tables, {:.2f} MB".format(len(corpus), tables, size))
+    before = best_time(legacy_parse, corpus, args.repeat)
+    after = best_time(parse_tables, corpus, args.repeat)
+    for name, elapsed in (("before", before), ("after", after)):
+        print("{:>6}: {:8.1f} posts/s  {:6.2f} MB/s".format(
+            name, len(corpus) / elapsed, size / elapsed))
+    print("speedup: {:.2f}x".format(before / after))
+
+
+if __name__ == "__main__":
+    main()
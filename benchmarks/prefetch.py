@@ -0,0 +1,57 @@
+'''scan_submissions wall time against FakeReddit at several concurrency
+levels.
+
+    python -m benchmarks.prefetch [--posts N] [--latency SECONDS]
+
+Each run scans the same fake listing with a fresh backend; workers=1
+is the old strictly sequential behaviour.
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import roll_one
+from scan_state import ScanState
+from benchmarks.fake_reddit import make_reddit
+
+
+def timed_scan(posts, latency, workers):
+    r = make_reddit(posts, latency)
+    state_dir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        roll_one.scan_submissions(
+            ScanState(os.path.join(state_dir, 'scan_state.json')), r, '', workers)
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return elapsed, sum(r.calls.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    print("{} posts, {:.0f} ms per API call".format(args.posts, args.latency * 1e3))
+    baseline = None
+    for workers in args.workers:
+        elapsed, calls = timed_scan(args.posts, args.latency, workers)
+        baseline = baseline or elapsed
+        print("workers={:<3} {:7.3f} s  {:4d} calls  {:5.2f}x".format(
+            workers, elapsed, calls, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+'''Import time and first-call latency of the Lambda handler module.
+
+    python -m benchmarks.startup [--runs N]
+
+Every run is a fresh interpreter, like a cold container.  It times
+`import lambda_entry`, then a first and a second (warm) invocation
+against FakeReddit with an empty table store in a temp directory.
+Reported numbers are medians over the runs.
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+_child = r'''
+import json, os, sys, time
+start = time.time()
+import lambda_entry
+imported = time.time() - start
+
+from benchmarks.fake_reddit import make_reddit
+import roll_one
+reddit = make_reddit(posts=%(posts)d, latency=%(latency)f)
+roll_one.sign_in = lambda: reddit
+
+class Context(object):
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+event = {'params': {'search_term': 'sunken goblin'}}
+stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+start = time.time()
+lambda_entry.lambda_handler(event, Context())
+first = time.time() - start
+start = time.time()
+lambda_entry.lambda_handler(event, Context())
+warm = time.time() - start
+sys.stdout = stdout
+print(json.dumps(dict(import_s=imported, first_call_s=first, warm_call_s=warm)))
+'''
+
+
+def run_once(posts, latency):
+    env = dict(os.environ)
+    env['TABLE_STORE'] = os.path.join(tempfile.mkdtemp(), 'store.sqlite')
+    out = subprocess.check_output(
+        [sys.executable, '-c', _child % dict(posts=posts, latency=latency)],
+        env=env)
+    return json.loads(out.decode('utf8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    runs = [run_once(args.posts, args.latency) for _ in range(args.runs)]
+    for key in ('import_s', 'first_call_s', 'warm_call_s'):
+        print("{:<13} {:8.1f} ms".format(key, median([r[key] for r in runs]) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
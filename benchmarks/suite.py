@@ -0,0 +1,168 @@
+'''Offline benchmarks for the parse, search, roll and serialise hot paths.
+
+    python -m benchmarks.suite [--min-time SECONDS] [--output FILE]
+
+Runs against the checked-in posts in benchmarks/corpus and prints one
+JSON document (or writes it to FILE), so results from two commits can
+be diffed or compared by a script.  Every figure is the best of
+--repeat timed loops of at least --min-time seconds each.  Parsing is
+timed with the parse cache off; parse_cached is the same loop with
+every post already cached.  for_json times building each payload,
+then reading its encoded text back from to_json's cache, and compares
+its size with the compact form's.
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import parse_cache
+from roll_one import get_table
+from table_sources import TableSourceFromText
+from benchmarks.corpus import load_corpus
+
+_queries = ['innkeeper', 'rumours bar', 'trinkets', 'goblin loot',
+            'magic item', 'carav', 'nothing matches this']
+
+
+def rate(func, min_time, repeat):
+    '''Best calls per second of func over repeat loops'''
+    best = 0.0
+    for _ in range(repeat):
+        calls = 0
+        start = time.time()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.time() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+
+def bench_parse(corpus, min_time, repeat):
+    max_bytes = parse_cache.cache.max_bytes
+    parse_cache.cache.max_bytes = 0
+    try:
+        return _bench_parse(corpus, min_time, repeat)
+    finally:
+        parse_cache.cache.max_bytes = max_bytes
+
+
+def bench_parse_cached(corpus, min_time, repeat):
+    texts = list(corpus.values())
+
+    def parse_all():
+        for text in texts:
+            TableSourceFromText(text, "bench")
+    parse_all()
+    return dict(posts_per_s=len(texts) * rate(parse_all, min_time, repeat))
+
+
+def _bench_parse(corpus, min_time, repeat):
+    results = {}
+    for name, text in sorted(corpus.items()):
+        per_s = rate(lambda: TableSourceFromText(text, name), min_time, repeat)
+        results[name] = dict(posts_per_s=per_s,
+                             mb_per_s=per_s * len(text.encode('utf8')) / 1e6)
+    texts = list(corpus.values())
+
+    def parse_all():
+        for text in texts:
+            TableSourceFromText(text, "bench")
+    results['all'] = dict(posts_per_s=len(texts) * rate(parse_all, min_time, repeat))
+    return results
+
+
+def bench_search(tables, min_time, repeat):
+    def search_all():
+        for query in _queries:
+            get_table(tables, query)
+    per_s = len(_queries) * rate(search_all, min_time, repeat)
+    return dict(tables=len(tables), queries_per_s=per_s, us_per_query=1e6 / per_s)
+
+
+def bench_roll(tables, min_time, repeat):
+    rng = random.Random(0)
+    # Only tables whose die fits their weights roll every time
+    rollable = [t for t in tables if t.compiled.die and t.compiled.cumulative
+                and t.compiled.die <= t.compiled.cumulative[-1]]
+
+    def roll_all():
+        for table in rollable:
+            table.roll(rng)
+
+    def roll_and_unpack_all():
+        for table in rollable:
+            table.roll(rng).unpack()
+    return dict(
+        tables=len(rollable),
+        rolls_per_s=len(rollable) * rate(roll_all, min_time, repeat),
+        roll_unpacks_per_s=len(rollable) * rate(roll_and_unpack_all, min_time, repeat))
+
+
+def bench_for_json(tables, min_time, repeat):
+    def serialise_all():
+        for table in tables:
+            table.for_json()
+
+    def serialise_all_cached():
+        for table in tables:
+            table.to_json()
+
+    return dict(tables=len(tables),
+                tables_per_s=len(tables) * rate(serialise_all, min_time, repeat),
+                cached_tables_per_s=len(tables) * rate(serialise_all_cached, min_time, repeat),
+                json_bytes=sum(len(table.to_json()) for table in tables),
+                compact_json_bytes=sum(len(table.to_json(compact=True)) for table in tables))
+
+
+def run(min_time=0.2, repeat=3):
+    '''All benchmark results; lprint chatter is discarded meanwhile'''
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return _run(min_time, repeat)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def _run(min_time, repeat):
+    corpus = load_corpus()
+    tables = [t for text in corpus.values()
+              for t in TableSourceFromText(text, "bench").tables]
+    return dict(
+        python=platform.python_version(),
+        corpus=sorted(corpus),
+        parse=bench_parse(corpus, min_time, repeat),
+        parse_cached=bench_parse_cached(corpus, min_time, repeat),
+        search=bench_search(tables, min_time, repeat),
+        roll=bench_roll(tables, min_time, repeat),
+        for_json=bench_for_json(tables, min_time, repeat),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = json.dumps(run(args.min_time, args.repeat), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
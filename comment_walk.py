@@ -0,0 +1,93 @@
+'''Finds the comments in a thread that may hold tables, at any depth.
+
+walk() fetches the submission's comment tree once and then works
+through it best first: comments whose body passes a cheap header test,
+then "load more comments" stubs under such comments, then the other
+comments, shallow before deep, and last the remaining stubs, largest
+first.  Stubs are the only nodes that cost another request.
+A WalkBudget caps those expansions, the comments examined and the
+wall time, so a huge thread costs a bounded number of requests.
+'''
+import heapq
+import itertools
+import re
+import time
+
+import praw
+
+# Expansions are "load more comments" requests
+_max_expansions = 5
+_max_nodes = 1000
+_max_seconds = 10.0
+
+# A line that starts, after any markup, with a die such as d6 or 2d10;
+# the same shape tables.tokenize looks for, without splitting lines
+_header_hint_re = re.compile(r"^[^\w\n]*\d*[dD]\d+", re.MULTILINE)
+
+# Node kinds, in the order they are visited
+_LIKELY, _MORE_LIKELY, _COMMENT, _MORE = range(4)
+
+
+def looks_like_table(body):
+    '''True if some line of body could be a table header'''
+    return bool(body) and _header_hint_re.search(body) is not None
+
+
+class WalkBudget(object):
+    '''Limits a walk to expansions more-comments requests, nodes comments
+    examined and seconds of wall time'''
+    def __init__(self, expansions=_max_expansions, nodes=_max_nodes,
+                 seconds=_max_seconds):
+        self.expansions = expansions
+        self.nodes = nodes
+        self.deadline = time.time() + seconds if seconds is not None else None
+        self.expanded = 0
+        self.visited = 0
+
+    def __repr__(self):
+        return '<WalkBudget: {} of {} expansions, {} of {} nodes>'.format(
+            self.expanded, self.expansions, self.visited, self.nodes)
+
+    def exhausted(self):
+        if self.visited >= self.nodes:
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def can_expand(self):
+        return self.expanded < self.expansions
+
+
+def walk(submission, budget=None):
+    '''Yields the comments of submission that look like they hold a
+    table, best candidates first, until the thread or budget runs out'''
+    budget = budget or WalkBudget()
+    order = itertools.count()
+    heap = []
+    seen = set()
+
+    def push(nodes, depth, likely_parent):
+        for node in nodes:
+            if isinstance(node, praw.models.MoreComments):
+                kind = _MORE_LIKELY if likely_parent else _MORE
+                rank = -(node.count or 0)
+            else:
+                kind = _LIKELY if looks_like_table(node.body) else _COMMENT
+                rank = -(getattr(node, 'score', 0) or 0)
+            heapq.heappush(heap, ((kind, depth, rank), next(order), node, depth))
+
+    push(submission.comments, 0, False)
+    while heap and not budget.exhausted():
+        (kind, _, _), _, node, depth = heapq.heappop(heap)
+        if kind in (_MORE, _MORE_LIKELY):
+            if not budget.can_expand():
+                continue
+            budget.expanded += 1
+            push(node.comments(), depth, kind == _MORE_LIKELY)
+            continue
+        if node.id in seen:
+            continue
+        seen.add(node.id)
+        budget.visited += 1
+        if kind == _LIKELY:
+            yield node
+        push(getattr(node, 'replies', ()), depth + 1, kind == _LIKELY)
@@ -0,0 +1,151 @@
+'''Background writer for requests the bot could not answer.
+
+Records are plain dicts built only from data already in memory:
+record() reads a praw object's instance dict rather than its
+attributes, so a lazy submission or author is never fetched just to
+be logged.  put() only queues the record; a daemon thread appends
+whatever has queued, as one gzip member of JSON lines, to
+<directory>/failures.jsonl.gz, and rotates the file once it passes
+max_bytes, like logging's RotatingFileHandler.
+
+    for entry in read('./logs/failures.jsonl.gz'): ...
+'''
+import atexit
+import gzip
+import json
+import os
+import threading
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from utils import fdate, lprint
+
+_file_name = 'failures.jsonl.gz'
+_max_bytes = 4 * 2 ** 20
+_backups = 5
+
+# Seconds to wait at exit for queued records to be written
+_close_timeout = 5.0
+
+# Fields copied from the origin comment or message, when loaded
+_origin_fields = ('name', 'author', 'subreddit', 'body', 'context',
+                  'link_title', 'link_id', 'created_utc')
+
+# Fields copied from its submission, if one was fetched anyway
+_submission_fields = ('title', 'selftext', 'url')
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _plain(value):
+    '''JSON-ready value, naming praw Redditors and Subreddits'''
+    if value is None or isinstance(value, (bool, int, float, type(u''))):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf8', 'replace')
+    fields = getattr(value, '__dict__', {})
+    return fields.get('name') or fields.get('display_name') or repr(value)
+
+
+def _loaded(obj, names):
+    fields = getattr(obj, '__dict__', {})
+    return dict((name, _plain(fields[name])) for name in names if name in fields)
+
+
+def record(origin, reason, table_sources=()):
+    '''Failure record for a praw comment or message; never touches the
+    network'''
+    entry = dict(time=fdate(), reason=reason, type=type(origin).__name__,
+                 origin=_loaded(origin, _origin_fields))
+    submission = getattr(origin, '__dict__', {}).get('_submission')
+    if submission is not None:
+        entry['submission'] = _loaded(submission, _submission_fields)
+    entry['sources'] = [dict(desc=source.desc,
+                             headers=[table.header for table in source.tables])
+                        for source in table_sources]
+    return entry
+
+
+class FailureLog(object):
+    def __init__(self, directory, max_bytes=_max_bytes, backups=_backups):
+        self.path = os.path.join(directory, _file_name)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return '<FailureLog at {}>'.format(self.path)
+
+    def put(self, entry):
+        '''Queues entry for writing and returns at once'''
+        self._queue.put(entry)
+
+    def close(self, timeout=_close_timeout):
+        '''Writes what is queued and stops the writer thread'''
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            entries = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stop = None in entries
+            entries = [e for e in entries if e is not None]
+            if entries:
+                try:
+                    self._write(entries)
+                except Exception as e:
+                    lprint("Could not write {} failure records: {}".format(len(entries), e))
+            if stop:
+                return
+
+    def _write(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        lines = ''.join(json.dumps(e, sort_keys=True) + '\n' for e in entries)
+        with gzip.open(self.path, 'ab') as f:
+            f.write(lines.encode('utf8'))
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        '''failures.jsonl.gz becomes failures.jsonl.gz.1, .1 becomes .2
+        and so on; the oldest beyond backups is dropped'''
+        for n in range(self.backups - 1, 0, -1):
+            older = '{}.{}'.format(self.path, n)
+            if os.path.exists(older):
+                os.rename(older, '{}.{}'.format(self.path, n + 1))
+        if self.backups:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+
+def writer(directory):
+    '''The shared FailureLog for directory, started on first use'''
+    with _writers_lock:
+        log = _writers.get(directory)
+        if log is None:
+            log = _writers[directory] = FailureLog(directory)
+        return log
+
+
+def read(path):
+    '''Yields the records in a failure log file, oldest first'''
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            yield json.loads(line.decode('utf8'))
@@ -0,0 +1,140 @@
+'''Bulk-loads a local subreddit archive into the table store.
+
+    python ingest.py ARCHIVE.jsonl[.gz|.bz2] ... [--store PATH] [--processes N]
+
+Each archive line is one JSON submission (with selftext) or comment
+(with body), as in the usual subreddit dumps.  Lines are read in
+chunks and parsed across a process pool; the main process only writes
+the finished rows, one transaction per chunk.  Submissions are stored
+under their id, comments under their fullname (t1_<id>) so the two id
+spaces cannot collide; search_tables and search_batch fetch either kind
+back by that key.  A record already stored with the same or a
+later edit time is skipped, and so is a line that is not a JSON
+object with an id and text; the progress lines count those.
+'''
+from __future__ import print_function
+
+import argparse
+import bz2
+import gzip
+import json
+import multiprocessing
+import time
+
+from tables import parse_tables
+from table_store import TableStore, rows, _store_path, _comment_prefix
+from utils import lprint
+
+_chunk_size = 500
+_progress_every = 10000
+
+
+def open_archive(path):
+    '''Binary file object for path; lines are decoded by json in the workers'''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    return open(path, 'rb')
+
+
+def chunks(paths, size=_chunk_size):
+    '''Lists of up to size raw lines across every archive in paths'''
+    chunk = []
+    for path in paths:
+        with open_archive(path) as f:
+            for line in f:
+                chunk.append(line)
+                if len(chunk) == size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def record_entry(record, items=False):
+    '''TableStore.put_rows entry for an archive record, or None if it has
+    no text or no tables'''
+    if not isinstance(record, dict):
+        raise TypeError('archive record is not a JSON object')
+    if 'selftext' in record:
+        key, text = record['id'], record['selftext']
+    elif 'body' in record:
+        key, text = _comment_prefix + record['id'], record['body']
+    else:
+        return None
+    if not text:
+        return None
+    tables = parse_tables(text)
+    if not tables:
+        return None
+    table_rows, term_rows = rows(key, tables, items)
+    return (key, float(record.get('edited') or 0),
+            float(record.get('created_utc') or 0), table_rows, term_rows)
+
+
+def parse_chunk(args):
+    '''Runs in a pool worker: (records read, records skipped as
+    malformed, store entries) for a chunk'''
+    lines, items = args
+    entries = []
+    bad = 0
+    for line in lines:
+        try:
+            entry = record_entry(json.loads(line), items)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            bad += 1
+            continue
+        if entry:
+            entries.append(entry)
+    return len(lines), bad, entries
+
+
+def ingest(paths, store, processes=None, chunk_size=_chunk_size):
+    '''Parses every archive in paths into store; returns (records read,
+    submissions and comments stored, malformed records skipped)'''
+    pool = multiprocessing.Pool(processes)
+    read = stored = skipped = 0
+    next_report = _progress_every
+    start = time.time()
+    try:
+        work = ((chunk, store.items) for chunk in chunks(paths, chunk_size))
+        for count, bad, entries in pool.imap_unordered(parse_chunk, work):
+            fresh = [e for e in entries if not store.is_current(e[0], e[1])]
+            store.put_rows(fresh)
+            read += count
+            stored += len(fresh)
+            skipped += bad
+            if read >= next_report:
+                next_report += _progress_every
+                lprint("Ingested {} records ({} stored, {} malformed) at {:.0f} "
+                       "records/s".format(read, stored, skipped,
+                                          read / (time.time() - start)))
+    finally:
+        pool.close()
+        pool.join()
+    return read, stored, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('archives', nargs='+')
+    parser.add_argument('--store', default=_store_path)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='parse workers (default: one per CPU)')
+    parser.add_argument('--chunk', type=int, default=_chunk_size,
+                        help='archive lines per work unit')
+    parser.add_argument('--items', action='store_true',
+                        help='also index item text for search')
+    args = parser.parse_args()
+
+    store = TableStore(args.store, items=args.items)
+    start = time.time()
+    read, stored, skipped = ingest(args.archives, store, args.processes, args.chunk)
+    elapsed = time.time() - start
+    lprint("Done: {} records, {} stored, {} malformed, in {:.1f} s ({:.0f} records/s)".format(
+        read, stored, skipped, elapsed, read / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
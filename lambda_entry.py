@@ -1,28 +1,175 @@
 from __future__ import print_function
 
-import boto3
 import json
-import praw
-import os
+import random
+
+import metrics
+import profiling
+
+# Only the standard library, metrics and profiling (themselves standard
+# library only) are imported here.  roll_one (and with it praw and the parser) is
+# imported by the first invocation that needs it; the Reddit client and
+# table store it builds are then kept for as long as Lambda keeps this
+# container warm.
+
+# Seconds held back from the invocation timeout to serialise and return
+_timeout_margin = 1.0
+
+# Limits on one batched invocation
+_max_queries = 50
+_max_rolls = 100
+
+# params['format'] asking for Table.for_compact_json payloads
+_compact = 'compact'
+
+_separators = (',', ':')
+
+_reddit = None
+_store = None
+
+
+class Encoded(object):
+    '''JSON text that encode() copies into a body as it is'''
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def encode(value):
+    '''JSON text of value, dicts, lists and scalars, with each Encoded
+    in it spliced in without being decoded'''
+    if isinstance(value, Encoded):
+        return value.text
+    if isinstance(value, dict):
+        return '{' + ','.join(json.dumps(key) + ':' + encode(item)
+                              for key, item in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(encode(item) for item in value) + ']'
+    return json.dumps(value, separators=_separators)
 
-import roll_one
 
 def respond(err, res=None):
+    '''The response; a successful body is res as JSON text, into which
+    the tables' cached to_json() text is copied'''
     return {
         'statusCode': '400' if err else '200',
-        'body': err.message if err else res,
+        'body': err.message if err else encode(res),
         'headers': {
             'Content-Type': 'application/json',
         },
     }
 
 
+def reddit():
+    '''The container's Reddit client, signed in on first use'''
+    global _reddit
+    if _reddit is None:
+        import roll_one
+        _reddit = roll_one.sign_in()
+    return _reddit
+
+
+def store():
+    '''The container's table store, opened on first use'''
+    global _store
+    if _store is None:
+        from table_store import TableStore
+        _store = TableStore()
+    return _store
+
+
+@metrics.timed('lambda')
 def lambda_handler(event, context):
+    '''An event with a "profile" key is profiled; see profiling'''
+    try:
+        with profiling.profile('lambda', event.get('profile')):
+            return _handle(event, context)
+    finally:
+        metrics.flush()
+
+
+def _handle(event, context):
+    import roll_one
     params = event['params']
+    compact = params.get('format') == _compact
+    if 'queries' in params:
+        return respond(None, batch(params, context))
     kwargs = dict(
         search_term=params['search_term'],
         sub_id=params.get('sub_id', None),
+        store=store(),
+        budget=invocation_budget(context),
     )
-    table = roll_one.find_table(roll_one.sign_in(), **kwargs)
-    payload = table.for_json() if table else {}
+    # With 'top', answer with the ranked list of up to that many matches
+    # instead of the single best table.
+    if 'top' in params:
+        matches = roll_one.search_tables(reddit(), k=int(params['top']), **kwargs)
+        return respond(None, [match_for_json(m, compact=compact) for m in matches])
+    table = roll_one.find_table(reddit(), **kwargs)
+    payload = table_for_json(table, compact) if table else {}
     return respond(None, payload)
+
+
+def invocation_budget(context):
+    '''Stops a live lookup in time to answer before Lambda times out'''
+    if context is None:
+        return None
+    from lookup import Budget
+    import roll_one
+    seconds = context.get_remaining_time_in_millis() / 1000.0 - _timeout_margin
+    return Budget(items=roll_one._fetch_limit, seconds=max(seconds, 0))
+
+
+def batch(params, context):
+    '''Answers params['queries'], a list of dicts with a search_term and
+    optionally a sub_id, top (matches wanted, default 1) and rolls (per
+    match, default 0), from one fetch and parse.  With params['format']
+    "compact", tables come in their compact form.  Rolls are drawn from
+    random.Random(params['seed']); the seed, made up if none is given,
+    is returned so the same request can be answered the same way.'''
+    import roll_one
+    queries = params['queries'][:_max_queries]
+    seed = params.get('seed')
+    if seed is None:
+        seed = random.randint(0, 2**32 - 1)
+    rng = random.Random(seed)
+    compact = params.get('format') == _compact
+    found = roll_one.search_batch(
+        reddit(),
+        [(q['search_term'], q.get('sub_id'), int(q.get('top', 1))) for q in queries],
+        store=store(),
+        budget=invocation_budget(context))
+    results = []
+    for query, matches in zip(queries, found):
+        rolls = min(int(query.get('rolls', 0)), _max_rolls)
+        results.append(dict(
+            search_term=query['search_term'],
+            sub_id=query.get('sub_id'),
+            matches=[match_for_json(m, rolls, rng, compact) for m in matches],
+        ))
+    return dict(seed=seed, results=results)
+
+
+def table_for_json(table, compact=False):
+    '''The table's cached JSON text, compact or in full'''
+    return Encoded(table.to_json(compact))
+
+
+def match_for_json(match, rolls=0, rng=None, compact=False):
+    sub_id, position = match.key
+    payload = dict(
+        score=match.score,
+        sub_id=sub_id,
+        position=position,
+        table=table_for_json(match.table, compact),
+    )
+    if rolls:
+        payload['rolls'] = [roll_for_json(match.table.roll(rng)) for _ in range(rolls)]
+    return payload
+
+
+def roll_for_json(roll):
+    if roll is None:
+        return None
+    return dict(rolled=roll.rolled, outcome=roll.out.outcome, text=roll.unpack())
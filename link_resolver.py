@@ -0,0 +1,121 @@
+'''Resolves the reddit links in a request to submissions and comments.
+
+Every markdown link in a message is normalised once, with a single
+regex, to the fullname of the post it names: t3_<id> for a
+submission, t1_<id> for a comment permalink.  Anything that is not a
+reddit post (other sites, subreddit pages, wiki pages) is dropped.
+Links naming the same post are resolved once.  Fullnames not in the
+shared cache are fetched together through reddit's info endpoint, 100
+to a request, the requests running side by side with prefetch, so a
+link-heavy message costs one round of fetches.  Resolved posts are
+kept for _ttl seconds, so a table post linked again in later requests
+is not fetched again.
+'''
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from ratelimit import scheduler
+from workers import prefetch
+
+_link_re = re.compile(r"\[(.*?)\]\s*\((.*?)\)")
+
+# www., old., np. and m. reddit.com permalinks, with or without the
+# subreddit, slug, comment id, .json or a query; and redd.it short links
+_post_re = re.compile(
+    r"^(?:https?://)?(?:[\w-]+\.)?(?:reddit\.com(?:/r/\w+)?/comments/(\w+)"
+    r"(?:/[^/?#]*(?:/(\w+))?)?|redd\.it/(\w+))",
+    re.IGNORECASE)
+
+_ttl = 10 * 60
+_max_entries = 2000
+_info_batch = 100
+_workers = 4
+
+
+def fullname(href):
+    '''Fullname of the post href links to, or None'''
+    match = _post_re.match(href.strip())
+    if not match:
+        return None
+    submission_id, comment_id, short_id = match.groups()
+    if comment_id and comment_id.lower() != 'json':
+        return 't1_' + comment_id.lower()
+    return 't3_' + (submission_id or short_id).lower()
+
+
+def links(body):
+    '''(description, fullname) for each distinct reddit post linked in
+    body, in the order first linked'''
+    found = OrderedDict()
+    for desc, href in _link_re.findall(body):
+        name = fullname(href)
+        if name and name not in found:
+            found[name] = desc
+    return [(desc, name) for name, desc in found.items()]
+
+
+class LinkCache(object):
+    '''Resolved posts by fullname, each kept for ttl seconds'''
+    def __init__(self, ttl=_ttl, max_entries=_max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<LinkCache: {} posts, {} hits, {} misses>'.format(
+            len(self._entries), self.hits, self.misses)
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, name, item):
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = (time.time() + self.ttl, item)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def resolve(self, r, names, workers=_workers):
+        '''{fullname: post} for those of names reddit still has.  The
+        fetches run on worker threads under the caller's scheduler
+        operation, so they keep its priority and its request count.'''
+        resolved = {}
+        missing = []
+        for name in names:
+            item = self.get(name)
+            if item is None:
+                missing.append(name)
+            else:
+                resolved[name] = item
+        metrics.count('link_cache_hits', len(resolved))
+        metrics.count('link_cache_misses', len(missing))
+        batches = [missing[i:i + _info_batch] for i in range(0, len(missing), _info_batch)]
+        fetch = scheduler.tagged(*scheduler.current())(lambda names: list(r.info(names)))
+        for batch in prefetch(batches, fetch, workers):
+            for item in batch:
+                self.put(item.fullname, item)
+                resolved[item.fullname] = item
+        return resolved
+
+
+cache = LinkCache()
+
+
+def resolve_links(r, body):
+    '''(description, post) for each distinct reddit post linked in body
+    that could be resolved, in the order first linked'''
+    named = links(body)
+    resolved = cache.resolve(r, [name for _, name in named])
+    return [(desc, resolved[name]) for desc, name in named if name in resolved]
@@ -0,0 +1,99 @@
+'''Lazy lookup pipeline over the live subreddit listing.
+
+    submissions -> sources -> tables -> matches
+
+Each stage is a generator pulling from the one before it, and praw
+only requests a listing page when the submissions stage asks for the
+next item.  Whoever consumes the matches decides when to stop, and
+nothing past that point is fetched or parsed.  A Budget stops the
+chain early on item count or wall time.
+'''
+import time
+
+import prawcore
+
+from search_index import Match, score, _min_score
+from table_sources import TableSource
+from table_store import edit_stamp
+from utils import lprint
+
+_subreddit = 'DnDBehindTheScreen'
+
+
+class Budget(object):
+    '''Limits a lookup to items submissions and seconds of wall time.
+    timed_out is set once the clock, rather than the item cap, stops a
+    walk; only then has the walk missed part of what it was allowed.'''
+    def __init__(self, items=None, seconds=None):
+        self.items = items
+        self.deadline = time.time() + seconds if seconds is not None else None
+        self.used = 0
+        self.timed_out = False
+
+    def __repr__(self):
+        return '<Budget: {} of {} items used>'.format(self.used, self.items)
+
+    def exhausted(self):
+        if self.items is not None and self.used >= self.items:
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.timed_out = True
+        return self.timed_out
+
+    def spend(self):
+        self.used += 1
+
+
+def submissions(r, budget, subreddit=_subreddit):
+    '''Newest submissions, until budget runs out'''
+    if budget.exhausted():
+        return
+    for item in r.subreddit(subreddit).new(limit=budget.items):
+        budget.spend()
+        yield item
+        if budget.exhausted():
+            return
+
+
+def sources(items, store=None):
+    '''A TableSource per item.  New or edited items are also written to
+    store, so a later full refresh has less to parse.  An item that
+    can't be parsed is skipped, and one that can't be stored is still
+    searched; only network errors end the walk.'''
+    for item in items:
+        try:
+            TS = TableSource(item, "scan")
+        except prawcore.PrawcoreException:
+            raise
+        except Exception as e:
+            lprint('Could not parse submission {}: {!r}'.format(item.id, e))
+            continue
+        if store is not None:
+            try:
+                edited = edit_stamp(item)
+                if not store.is_current(item.id, edited):
+                    store.put(item.id, edited, item.created_utc, TS.tables)
+            except prawcore.PrawcoreException:
+                raise
+            except Exception as e:
+                lprint('Could not store submission {}: {!r}'.format(item.id, e))
+        yield TS
+
+
+def tables(table_sources):
+    '''((submission id, position), Table) for every parsed table'''
+    for TS in table_sources:
+        for position, table in enumerate(TS.tables):
+            yield (TS.source.id, position), table
+
+
+def matches(keyed_tables, search_term, min_score=_min_score):
+    for key, table in keyed_tables:
+        relevance = score(search_term, table)
+        if relevance >= min_score:
+            yield Match(relevance, key, table)
+
+
+def stream(r, search_term, budget, store=None):
+    '''Matches for search_term from the live listing, newest first'''
+    return matches(tables(sources(submissions(r, budget), store)), search_term)
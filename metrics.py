@@ -0,0 +1,168 @@
+'''Counters and latency histograms for the bot's stages.
+
+Set TABLE_GENIE_METRICS to a file path to turn metrics on; flush()
+then writes everything there, as JSON if the path ends in .json and
+in the Prometheus text format otherwise (point node_exporter's
+textfile collector at it to scrape).  The variable is read once, at
+import: when it is unset, timed() hands back the function undecorated
+and timer() and count() return at once, so the hot paths pay nothing.
+
+Histograms keep counts in fixed buckets, from 10 us to 60 s, so their
+memory is constant; quantile() interpolates within a bucket.
+'''
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_path = os.environ.get('TABLE_GENIE_METRICS')
+enabled = bool(_path)
+
+_prefix = 'table_genie_'
+
+# Histogram bucket upper bounds, in seconds
+_buckets = tuple(m * 10 ** e for e in range(-5, 2) for m in (1, 2.5, 5)) + (60.0,)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(_buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(_buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''Estimated q-quantile (0 < q < 1), or None if empty'''
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = _buckets[i - 1] if i else 0.0
+                high = _buckets[i] if i < len(_buckets) else _buckets[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return _buckets[-1]
+
+
+def count(name, n=1):
+    '''Adds n to counter name'''
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name, seconds):
+    '''Records a duration in histogram name'''
+    if not enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_no_timer = _NoTimer()
+
+
+@contextmanager
+def _timer(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start)
+
+
+def timer(name):
+    '''Context manager timing its block into histogram name'''
+    return _timer(name) if enabled else _no_timer
+
+
+def timed(name):
+    '''Decorator timing every call into histogram name; a no-op when
+    metrics are off'''
+    def decorate(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.time() - start)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    '''Every counter, and count, sum, p50 and p99 of every histogram'''
+    with _lock:
+        return dict(
+            counters=dict(_counters),
+            timers=dict((name, dict(count=h.count, sum=h.sum,
+                                    p50=h.quantile(0.5), p99=h.quantile(0.99)))
+                        for name, h in _histograms.items()))
+
+
+def prometheus():
+    '''Everything in the Prometheus text exposition format'''
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            metric = _prefix + name + '_total'
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, _counters[name]))
+        for name in sorted(_histograms):
+            histogram = _histograms[name]
+            metric = _prefix + name + '_seconds'
+            lines.append('# TYPE {} histogram'.format(metric))
+            cumulative = 0
+            for bound, n in zip(_buckets, histogram.counts):
+                cumulative += n
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, histogram.count))
+            lines.append('{}_sum {}'.format(metric, histogram.sum))
+            lines.append('{}_count {}'.format(metric, histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+def flush(path=None):
+    '''Writes every metric to path (default: TABLE_GENIE_METRICS)'''
+    path = path or _path
+    if not enabled or not path:
+        return
+    if path.endswith('.json'):
+        text = json.dumps(snapshot(), indent=2, sort_keys=True)
+    else:
+        text = prometheus()
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
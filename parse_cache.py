@@ -0,0 +1,90 @@
+'''Parsed tables, remembered by the text they were parsed from.
+
+The scan loop, find_table and every summons in a busy thread see the
+same unchanged posts again and again.  parse() looks the text up by
+its SHA-1 first and only runs the parser on a miss.  Entries are
+evicted least recently used first once the estimated memory they hold
+passes max_bytes; hits, misses and evictions are counted here and, if
+enabled, in metrics.
+
+Cached Table objects are shared by everyone who parses the same text,
+which is safe because nothing changes a Table once it is built; each
+caller gets its own list.
+'''
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+from tables import parse_tables
+
+_max_bytes = 64 * 2 ** 20
+
+# Parsed tables hold four to five times their text in memory, on top
+# of the text itself (measured with tracemalloc over make_corpus)
+_bytes_per_char = 6
+
+
+class ParseCache(object):
+    def __init__(self, max_bytes=_max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ParseCache: {} posts, {:.1f} of {:.1f} MB, {} hits, {} misses>'.format(
+            len(self._entries), self.size / 1e6, self.max_bytes / 1e6,
+            self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def parse(self, text):
+        '''parse_tables(text), from the cache when the text was seen.
+        A cache with max_bytes 0 is off and always parses.'''
+        if not self.max_bytes:
+            return parse_tables(text)
+        data = text if isinstance(text, bytes) else text.encode('utf8')
+        key = hashlib.sha1(data).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.pop(key)
+                self._entries[key] = entry
+                self.hits += 1
+        if entry is not None:
+            metrics.count('parse_cache_hits')
+            return list(entry[1])
+        tables = parse_tables(text)
+        metrics.count('parse_cache_misses')
+        self._add(key, len(text) * _bytes_per_char, tables)
+        return list(tables)
+
+    def _add(self, key, cost, tables):
+        with self._lock:
+            self.misses += 1
+            if cost > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = (cost, tables)
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, (old_cost, _) = self._entries.popitem(last=False)
+                self.size -= old_cost
+                self.evictions += 1
+                metrics.count('parse_cache_evictions')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+cache = ParseCache()
+
+
+def parse(text):
+    return cache.parse(text)
@@ -0,0 +1,192 @@
+'''Opt-in profiles of single Lambda invocations and main() passes.
+
+A profiled block is sampled: every _interval seconds a daemon thread
+records the stack of every other thread, so the cost is bounded by the
+sampling rate rather than by how many calls the block makes.  The
+counts are written as collapsed stacks, one "thread;outer;...;inner
+count" line per stack, which flamegraph.pl and speedscope read.  In
+deterministic mode the calling thread also runs under cProfile, whose
+stats are written beside them for pstats; that is exact but can double
+the run time of parse-heavy code.
+
+Profiling is off unless asked for:
+
+* TABLE_GENIE_PROFILE=<directory> profiles every lambda_handler call
+  and main() pass into directory, in TABLE_GENIE_PROFILE_MODE ("sample"
+  by default, or "deterministic").  With TABLE_GENIE_PROFILE_MIN_SECONDS
+  set, only blocks that took at least that long are kept, so it can be
+  left on to catch slow calls after the fact.
+* An event with "profile": "sample", "deterministic" or true profiles
+  that one invocation, into TABLE_GENIE_PROFILE or a directory under
+  the temp dir, whatever it took.
+
+Only the newest _max_files profiles are kept.  Files are named
+<name>-<time>-<pid>-<n>-<milliseconds>ms.collapsed (and .pstats).
+Like metrics, this module imports only the standard library, so
+lambda_entry can import it without slowing a cold start.
+'''
+import cProfile
+import glob
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+_directory = os.environ.get('TABLE_GENIE_PROFILE')
+_mode = os.environ.get('TABLE_GENIE_PROFILE_MODE', 'sample')
+_min_seconds = float(os.environ.get('TABLE_GENIE_PROFILE_MIN_SECONDS', 0))
+
+_default_directory = os.path.join(tempfile.gettempdir(), 'table_genie_profiles')
+
+SAMPLE = 'sample'
+DETERMINISTIC = 'deterministic'
+
+# At most 200 samples a second, fewer while a busy thread holds the
+# GIL; about 1% on a cold lookup
+_interval = 0.005
+_max_files = 200
+
+_sequence = Counter()
+_sequence_lock = threading.Lock()
+
+
+def _label(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def collapse(thread_name, frame):
+    '''thread_name;outermost;...;innermost for the stack ending at frame'''
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ';'.join(reversed(labels))
+
+
+class Sampler(object):
+    '''Counts the collapsed stacks of every other thread, every interval
+    seconds, from a daemon thread between start() and stop()'''
+    def __init__(self, interval=_interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+
+    def __repr__(self):
+        return '<Sampler: {} samples, {} stacks>'.format(self.samples, len(self.stacks))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = self._thread.ident
+        while not self._stop.wait(self.interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.stacks[collapse(names.get(ident, str(ident)), frame)] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, n in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, n))
+
+
+def _base_path(directory, name, seconds):
+    with _sequence_lock:
+        _sequence[name] += 1
+        n = _sequence[name]
+    return os.path.join(directory, '{}-{}-{}-{}-{}ms'.format(
+        name, time.strftime('%Y%m%dT%H%M%S'), os.getpid(), n, int(seconds * 1000)))
+
+
+def _prune(directory, max_files=_max_files):
+    '''Removes all but the newest max_files profiles in directory'''
+    paths = glob.glob(os.path.join(directory, '*.collapsed'))
+    if len(paths) <= max_files:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:-max_files]:
+        for old in (path, path[:-len('.collapsed')] + '.pstats'):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def _settings(requested):
+    '''(directory, mode, min_seconds) for a block, or None if it is not
+    to be profiled.  requested is an event's "profile" value.'''
+    if requested:
+        mode = requested if requested in (SAMPLE, DETERMINISTIC) else _mode
+        return _directory or _default_directory, mode, 0.0
+    if _directory:
+        return _directory, _mode, _min_seconds
+    return None
+
+
+@contextmanager
+def _profile(name, directory, mode, min_seconds):
+    sampler = Sampler()
+    profiler = cProfile.Profile() if mode == DETERMINISTIC else None
+    start = time.time()
+    sampler.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        sampler.stop()
+        seconds = time.time() - start
+        if seconds >= min_seconds:
+            from utils import lprint
+            try:
+                _save(name, directory, seconds, sampler, profiler)
+            except (IOError, OSError) as e:
+                lprint("Could not save profile of {}: {}".format(name, e))
+
+
+def _save(name, directory, seconds, sampler, profiler):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = _base_path(directory, name, seconds)
+    sampler.write(path + '.collapsed')
+    if profiler:
+        profiler.dump_stats(path + '.pstats')
+    _prune(directory)
+    from utils import lprint
+    lprint("Profiled {} ({:.2f} s, {} samples) to {}".format(
+        name, seconds, sampler.samples, path))
+
+
+class _NoProfile(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_no_profile = _NoProfile()
+
+
+def profile(name, requested=None):
+    '''Context manager profiling its block as name, if either the
+    environment or requested (an event's "profile" value) asks for it'''
+    settings = _settings(requested)
+    if settings is None:
+        return _no_profile
+    return _profile(name, *settings)
@@ -0,0 +1,151 @@
+'''One gate for every request made to Reddit.
+
+sign_in() builds its praw client with ScheduledRequestor, so each HTTP
+request praw makes, however lazily, first takes a token from the shared
+scheduler.  Tokens refill at a fixed rate up to a burst; when threads
+queue for them, the lowest priority number goes first, so a pending
+reply is never stuck behind a background scan.
+
+Code marks what it is doing with scheduler.operation() (or wraps a
+function run on worker threads with scheduler.tagged()), and every
+request is counted, with the bytes it returned, against the innermost
+operation on its thread.  report() summarises where the budget went.
+'''
+import functools
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from prawcore import Requestor
+
+# Reddit allows OAuth clients 60 requests a minute
+_requests_per_second = 1.0
+_burst = 10
+
+# Priorities; lower numbers are served first
+REPLY = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+
+_untagged = 'untagged'
+
+
+class TokenBucket(object):
+    '''rate tokens a second, holding at most burst.  take() blocks until
+    a token is free; waiters are served by priority, then arrival.'''
+
+    def __init__(self, rate=_requests_per_second, burst=_burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, priority=BACKGROUND):
+        '''Blocks until a token is free for this caller; returns the
+        seconds spent waiting'''
+        start = time.time()
+        ticket = (priority, next(self._order))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._waiting[0] == ticket:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        heapq.heappop(self._waiting)
+                        self._cond.notify_all()
+                        return time.time() - start
+                    self._cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self._cond.wait()
+
+
+class Scheduler(object):
+    def __init__(self, rate=_requests_per_second, burst=_burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.calls = Counter()
+        self.bytes = Counter()
+        self.waited = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return '<Scheduler at {}/s, {} calls>'.format(
+            self.bucket.rate, sum(self.calls.values()))
+
+    def current(self):
+        '''(operation name, priority) for this thread'''
+        return getattr(self._local, 'operation', (_untagged, BACKGROUND))
+
+    @contextmanager
+    def operation(self, name, priority=None):
+        '''Counts requests made in the block against name.  Without a
+        priority, the enclosing operation's is kept.'''
+        previous = self.current()
+        if priority is None:
+            priority = previous[1]
+        self._local.operation = (name, priority)
+        try:
+            yield
+        finally:
+            self._local.operation = previous
+
+    def tagged(self, name, priority=None):
+        '''Decorator running func inside operation(name, priority); for
+        functions handed to worker threads'''
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.operation(name, priority):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def send(self, request, *args, **kwargs):
+        '''Calls request(*args, **kwargs) once a token is free, and
+        accounts for it'''
+        name, priority = self.current()
+        waited = self.bucket.take(priority)
+        response = request(*args, **kwargs)
+        size = len(response.content or b'')
+        with self._lock:
+            self.calls[name] += 1
+            self.bytes[name] += size
+            self.waited[name] += waited
+        return response
+
+    def report(self):
+        '''One line per operation, busiest first'''
+        with self._lock:
+            return ["{}: {} calls, {:.1f} kB, {:.1f} s waiting".format(
+                name, calls, self.bytes[name] / 1e3, self.waited[name])
+                for name, calls in self.calls.most_common()]
+
+
+scheduler = Scheduler()
+
+
+class ScheduledRequestor(Requestor):
+    '''prawcore Requestor whose requests go through a Scheduler; pass
+    scheduler in praw.Reddit's requestor_kwargs to use another one'''
+
+    def __init__(self, *args, **kwargs):
+        # Set before Requestor.__init__: its __getattr__ forwards
+        # unknown names to the session it has yet to create.
+        self.scheduler = kwargs.pop('scheduler', scheduler)
+        super(ScheduledRequestor, self).__init__(*args, **kwargs)
+
+    def request(self, *args, **kwargs):
+        return self.scheduler.send(super(ScheduledRequestor, self).request,
+                                   *args, **kwargs)
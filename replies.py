@@ -0,0 +1,49 @@
+'''Packs rendered rolls into reddit replies.
+
+A request renders to a list of blocks, one per table roll.  chain()
+packs them, in order, into as few replies as fit reddit's limit,
+breaking only between blocks, so a table's roll is never cut in half
+unless it is too long for a reply of its own.  process_mail posts the
+replies as a chain, each answering the one before.  Everything is
+built from lists and joined once, so the cost is linear in the text.
+'''
+
+# Reddit's limit on the length of a comment or message
+_reply_limit = 10000
+
+_continued = "\n\n*(Continued in the reply below.)*"
+
+
+def _pieces(blocks, room):
+    '''blocks, with any longer than room broken between lines, and any
+    line longer than room broken anywhere'''
+    for block in blocks:
+        if len(block) <= room:
+            yield block
+            continue
+        for line in block.splitlines(True):
+            while len(line) > room:
+                yield line[:room]
+                line = line[room:]
+            yield line
+
+
+def chain(blocks, footer="", limit=_reply_limit):
+    '''Reply texts of at most limit characters holding blocks in order.
+    Every reply but the last ends with a note that it continues; the
+    last ends with footer.'''
+    room = limit - max(len(_continued), len(footer))
+    if room <= 0:
+        raise ValueError("footer leaves no room in a {} character reply".format(limit))
+    replies = []
+    parts = []
+    size = 0
+    for piece in _pieces(blocks, room):
+        if parts and size + len(piece) > room:
+            replies.append("".join(parts) + _continued)
+            parts = []
+            size = 0
+        parts.append(piece)
+        size += len(piece)
+    replies.append("".join(parts) + footer)
+    return replies
@@ -9,22 +9,34 @@
 # generation deep in comments.
 
 # To add: Look for tables that are actual tables.
-# Look for keyword ROLL in tables and scan for arbitrary depth
 
 from __future__ import unicode_literals
 # try:
 #     import simplejson as json
 # except ImportError:
 import json
+import re
 
 import sys
 import os
 import time
-import re
 
 import praw
+import prawcore
+from praw.const import API_PATH
+from requests.exceptions import RequestException
 from utils import lprint, pprint
 from table_sources import TableSource, Request
+from table_store import TableStore, reddit_fullname
+from search_index import HeaderIndex
+from workers import prefetch, Pipeline
+from lookup import Budget, stream, submissions, sources
+from scan_state import ScanState
+import metrics
+import profiling
+import failure_log
+import replies
+from ratelimit import scheduler, ScheduledRequestor, REPLY, INTERACTIVE, BACKGROUND
 
 try:
     full_path = os.path.abspath(__file__)
@@ -40,9 +52,41 @@ except:
 _version="1.4.1"
 _last_updated="2016-04-18"
 
-_seen_max_len = 50
 _fetch_limit = 1000
 
+# A watermark pass lists one page; if that page comes back full, or
+# every _full_scan_every passes in case the watermark post has been
+# deleted (reddit then lists nothing before it), the next pass lists
+# the full _fetch_limit instead.
+_watermark_page = 100
+_full_scan_every = 60
+
+_sleep_between_checks = 60
+
+# Submissions and their comment trees fetched ahead of the parser
+_prefetch_workers = 8
+
+# find_table re-scans the subreddit into the table store at most this
+# often (seconds); in between, lookups are answered from the store.
+_store_refresh_interval = 15 * 60
+
+# process_mail: threads fetching and parsing requests, items admitted
+# to the pipeline at once, and items per mark-read call
+_mail_workers = 4
+_mail_in_flight = 16
+_mark_read_batch = 25
+
+# Reply attempts through reddit's RATELIMIT errors, and the longest
+# single wait (seconds)
+_reply_attempts = 3
+
+# Failures that may well not happen again: dropped connections and
+# timeouts, 5xx responses and 429s.  Mail that meets one is left unread,
+# to be tried on the next pass.
+_transient_errors = (prawcore.ServerError, prawcore.RequestException, RequestException)
+_transient_statuses = (429,)
+_max_ratelimit_wait = 600
+
 _log_dir = "./logs"
 
 _trivial_passes_per_heartbeat = 30
@@ -56,7 +100,8 @@ def main(debug=False, search_word=''):
     '''
     # Initialize
     lprint("Begin main()")
-    seen_by_sentinel = []
+    scan_state = ScanState()
+    lprint("Loaded {}".format(scan_state))
     # Core loop
     while True:
         try:
@@ -66,12 +111,16 @@ def main(debug=False, search_word=''):
             # print r.user.me()
             trivial_passes_count = _trivial_passes_per_heartbeat - 1
             while True:
-                # was_mail = process_mail(r)
-                was_mail = False
-                was_sub = scan_submissions(seen_by_sentinel, r, search_word)
+                with profiling.profile('main'):
+                    # was_mail = process_mail(r)
+                    was_mail = False
+                    was_sub = scan_submissions(scan_state, r, search_word)
                 trivial_passes_count += 1 if not was_mail and not was_sub else 0
                 if trivial_passes_count == _trivial_passes_per_heartbeat:
                     lprint("Heartbeat.  {} passes without incident (or first pass).".format(_trivial_passes_per_heartbeat))
+                    for line in scheduler.report():
+                        lprint("API use, {}".format(line))
+                    metrics.flush()
                     trivial_passes_count = 0
                 time.sleep(_sleep_between_checks)
         except Exception as e:
@@ -82,8 +131,43 @@ def main(debug=False, search_word=''):
         sys.stdout.flush()
 
 
+@scheduler.tagged('scan fetch', BACKGROUND)
+def fetch_source(item):
+    '''Parses item into a TableSource and, if it has tables, loads its
+    comment tree so later access does not block.'''
+    TS = TableSource(item, "scan")
+    if TS.tables:
+        list(TS.source.comments)
+    return TS
+
+
+def new_submissions(r, state):
+    '''Submissions newer than state's watermark, newest first; the full
+    listing when a watermark pass can't be trusted.'''
+    BtS = r.subreddit('DnDBehindTheScreen')
+    state.passes += 1
+    if state.watermark and not state.full_scan_due \
+       and state.passes % _full_scan_every:
+        listed = watermark_page(r, 'DnDBehindTheScreen', state.watermark)
+        state.full_scan_due = len(listed) >= _watermark_page
+        return listed
+    state.full_scan_due = False
+    return list(BtS.new(limit=_fetch_limit))
+
+
+def watermark_page(r, subreddit, watermark):
+    '''The one page of subreddit's newest submissions listed before
+    watermark.  Requested directly: a ListingGenerator follows the
+    page's 'after' cursor whenever it is short of the limit, sending a
+    second request with both cursors set.'''
+    path = API_PATH['subreddit'].format(subreddit=subreddit) + 'new'
+    return list(r.get(path, params={'before': watermark, 'limit': _watermark_page}))
+
+
 # Returns true if anything happened
-def scan_submissions(seen, r, search_word):
+@metrics.timed('scan')
+@scheduler.tagged('scan', BACKGROUND)
+def scan_submissions(seen, r, search_word, workers=_prefetch_workers):
     '''This function groups the following:
     * Get the newest submissions to /r/DnDBehindTheStreen
     * Attempt to parse the item as containing tables
@@ -92,6 +176,12 @@ def scan_submissions(seen, r, search_word):
     # * Update list of seen tables
     # * Prune seen tables list if large.
 
+    Submissions are parsed, and the comment trees of those with tables
+    fetched, on up to workers threads ahead of this loop.  seen is a
+    ScanState: only submissions newer than its watermark are listed,
+    ids already in it are skipped unparsed, and it is saved after
+    every pass.
+
     '''
     try:
         # keep_it_tidy_reply = (
@@ -100,11 +190,13 @@ def scan_submissions(seen, r, search_word):
         #     " of these tables, please make your /u/roll_one_for_me requests"
         #     " as children to this comment." +
         #     BeepBoop() )
-        BtS = r.subreddit('DnDBehindTheScreen')
-        new_subs = BtS.new(limit=_fetch_limit)
+        listed = new_submissions(r, seen)
+        new_subs = [item for item in listed if item.id not in seen]
         saw_something_said_something = False
-        for item in new_subs:
-            TS = TableSource(item, "scan")
+        metrics.count('submissions_listed', len(listed))
+        for TS in prefetch(new_subs, fetch_source, workers):
+            seen.add(TS.source.id)
+            metrics.count('submissions_scanned')
             if TS.tables:
                 lprint('Found tables, maybe, for submission {}'
                        .format(TS.source.url))
@@ -118,84 +210,217 @@ def scan_submissions(seen, r, search_word):
                     lprint(matching_table.for_json())
                 # lprint(TS.tables)
                 top_level_authors = [com.author for com in TS.source.comments]
-                # Check if I have already replied
-                if not TS.source in seen:
-                    seen.append(TS.source)
-                    # if not r.user in top_level_authors:
-                        # lprint('DEBUG: Not adding comment to post.')
-                        # item.add_comment(keep_it_tidy_reply)
-                        # lprint("Adding organizational comment to thread with title: {}".format(TS.source.title))
-                        # saw_something_said_something = True
-
-        # Prune list to max size
-        seen[:] = seen[-_seen_max_len:]
+                # Only unseen submissions get here, so no reply yet
+                # if not r.user in top_level_authors:
+                    # lprint('DEBUG: Not adding comment to post.')
+                    # item.add_comment(keep_it_tidy_reply)
+                    # lprint("Adding organizational comment to thread with title: {}".format(TS.source.title))
+                    # saw_something_said_something = True
+
+        if listed:
+            seen.advance(listed[0].fullname)
+        seen.save()
         return saw_something_said_something
     except Exception as e:
         lprint("Error during submissions scan: {}".format(e))
         raise
 
 
+@metrics.timed('search')
 def get_table(tables, search_term):
+    '''Best match for search_term among tables' headers, or None'''
     if not search_term:
         return None
 
-    for table in tables:
-        # Case insensitive search
-        if re.search(search_term, table.header, re.I):
-            return table
+    matches = HeaderIndex(tables).search(search_term, 1)
+    if matches:
+        return matches[0].table
+
 
+def find_table(r, search_term, sub_id=None, store=None, budget=None):
+    matches = search_tables(r, search_term, 1, sub_id, store, budget)
+    if matches:
+        return matches[0].table
 
-def find_table(r, search_term, sub_id=None):
+
+@scheduler.tagged('lookup', INTERACTIVE)
+def search_tables(r, search_term, k=10, sub_id=None, store=None, budget=None):
+    '''Up to k search_index.Match results for search_term, each keyed by
+    (submission id, table position); tables from an archived comment
+    are keyed by its fullname instead, which sub_id also takes.
+
+    A fresh table store is searched and ranked directly.  Otherwise the
+    live listing is streamed, newest first, until k matches are found
+    or budget (a lookup.Budget; by default _fetch_limit submissions)
+    runs out.  Those are the first k matches in listing order, not
+    the best k of the subreddit; they are returned ranked by score,
+    newest first on ties.  A stream that reaches the end of the
+    listing or the budget's item cap, rather than its deadline, leaves
+    the store fresh.
+
+    '''
+    if not search_term:
+        return []
+    store = store or TableStore()
     if sub_id:
-        submission = r.submission(id=sub_id)
-        TS = TableSource(submission, "scan")
-        if TS.tables:
-            table = get_table(TS.tables, search_term)
-            if table:
-                return table
+        store.refresh(r.info([reddit_fullname(sub_id)]), mark=False)
+        return store.search(search_term, k, sub_id)
+    age = store.age()
+    if age is not None and age <= _store_refresh_interval:
+        return store.search(search_term, k)
+    budget = budget or Budget(items=_fetch_limit)
+    found = []
+    for match in stream(r, search_term, budget, store):
+        found.append(match)
+        if len(found) == k:
+            break
     else:
-        BtS = r.subreddit('DnDBehindTheScreen')
-        new_subs = BtS.new(limit=_fetch_limit)
-        for item in new_subs:
-            TS = TableSource(item, "scan")
-            if TS.tables:
-                # for table in TS.tables:
-                #     pprint(table.for_json())
-                table = get_table(TS.tables, search_term)
-                if table:
-                    return table
+        if not budget.timed_out:
+            store.mark_refreshed()
+    # Stable, so equal scores keep the stream's newest-first order
+    found.sort(key=lambda match: -match.score)
+    return found
+
+
+@scheduler.tagged('lookup', INTERACTIVE)
+def search_batch(r, queries, store=None, budget=None):
+    '''search_index.Match lists answering each of queries, a sequence of
+    (search_term, sub_id or None, k), from a single fetch and parse.
+
+    The submissions (or, for t1_ keys, comments) named by sub_id are
+    fetched together, 100 to a request, and refreshed in the store.  If any query searches the
+    whole subreddit and the store is stale, the live listing is walked
+    into the store once, within budget; unless the deadline cut that
+    walk short, the store is then fresh.  Every query is then answered
+    from the store.
+
+    '''
+    store = store or TableStore()
+    sub_ids = sorted(set(sub_id for _, sub_id, _ in queries if sub_id))
+    if sub_ids:
+        store.refresh(r.info([reddit_fullname(sub_id) for sub_id in sub_ids]), mark=False)
+    if any(term and not sub_id for term, sub_id, _ in queries):
+        age = store.age()
+        if age is None or age > _store_refresh_interval:
+            budget = budget or Budget(items=_fetch_limit)
+            for _ in sources(submissions(r, budget), store):
+                pass
+            if not budget.timed_out:
+                store.mark_refreshed()
+    return [store.search(term, k, sub_id) if term else []
+            for term, sub_id, k in queries]
 
 
 # returns True if anything processed
+@metrics.timed('process_mail')
+@scheduler.tagged('mail', INTERACTIVE)
 def process_mail(r):
-    '''Processes notifications.  Returns True if any item was processed.'''
-    my_mail = list(r.get_unread(unset_has_mail=False))
-    to_process = [Request(x, r) for x in my_mail]
-    for item in to_process:
-        if item.is_summons() or item.is_PM():
-            reply_text = item.roll()
-            okay = True
-            if not reply_text:
-                reply_text = ("I'm sorry, but I can't find anything"
-                              " that I know how to parse.\n\n")
-                okay = False
-            reply_text += BeepBoop()
-            if len(reply_text) > 10000:
-                addition = ("\n\n**This reply would exceed 10000 characters"
-                            " and has been shortened.  Chaining replies is an"
-                            " intended future feature.")
-                clip_point = 10000 - len(addition) - len(BeepBoop()) - 200
-                reply_text = reply_text[:clip_point] + addition + BeepBoop()
-            item.reply(reply_text)
-            lprint("{} resolving request: {}.".format(
-                "Successfully" if okay else "Questionably", item))
-            if not okay:
-                item.log(_log_dir)
-        else:
-            lprint("Mail is not summons or error.  Logging item.")
-            item.log(_log_dir)
-        item.origin.mark_as_read()
-    return ( 0 < len(to_process))
+    '''Processes notifications.  Returns True if any item was processed.
+
+    Unread items go through a Pipeline: fetching and parsing a
+    request's sources runs on _mail_workers threads, rolling on one,
+    and replying on one so replies queue behind reddit's per-account
+    rate limit instead of racing it.  Items are marked read in batches
+    as they leave the pipeline, except those a transient() error
+    stopped, which stay unread to be retried on the next pass.  Replies outrank
+    every other Reddit request in the scheduler.'''
+    fetch = scheduler.tagged('mail', INTERACTIVE)(lambda origin: Request(origin, r))
+    pipeline = Pipeline([
+        ('fetch', metrics.timed('mail_fetch')(fetch), _mail_workers),
+        ('roll', metrics.timed('mail_roll')(compose_reply), 1),
+        ('reply', metrics.timed('mail_reply')(send_reply), 1),
+    ], max_in_flight=_mail_in_flight)
+    finished = []
+    processed = 0
+    try:
+        for origin, _, error in pipeline.run(r.inbox.unread(limit=None)):
+            if error is not None:
+                lprint("Failed on mail {}: {!r}".format(origin.fullname, error))
+                metrics.count('mail_errors')
+                if transient(error):
+                    continue
+                failure_log.writer(_log_dir).put(failure_log.record(origin, repr(error)))
+            finished.append(origin)
+            processed += 1
+            if len(finished) >= _mark_read_batch:
+                r.inbox.mark_read(finished)
+                finished = []
+    finally:
+        if finished:
+            r.inbox.mark_read(finished)
+    metrics.count('mail_items', processed)
+    if processed:
+        lprint("Processed {} mail items; peak queue depths: {}".format(
+            processed, ", ".join("{} {}".format(name, depth)
+                                 for name, depth in pipeline.peak.items())))
+    return 0 < processed
+
+
+def transient(error):
+    '''Whether error may pass on a retry; Forbidden, NotFound and other
+    client errors will not, so their mail is logged and marked read'''
+    if isinstance(error, _transient_errors):
+        return True
+    if isinstance(error, prawcore.ResponseException):
+        status = getattr(error.response, 'status_code', 0)
+        return status in _transient_statuses or status >= 500
+    return False
+
+
+@scheduler.tagged('mail', INTERACTIVE)
+def compose_reply(item):
+    '''(item, reply texts, okay) for a summons or PM; anything else is
+    logged and goes no further.  Output too long for one reply is split
+    between tables into a chain of replies.'''
+    if not (item.is_summons() or item.is_PM()):
+        lprint("Mail is not summons or error.  Logging item.")
+        item.log(_log_dir, "not a summons")
+        return None
+    blocks = item.roll_blocks()
+    okay = True
+    if not blocks:
+        blocks = ["I'm sorry, but I can't find anything"
+                  " that I know how to parse.\n\n"]
+        okay = False
+    return item, replies.chain(blocks, BeepBoop()), okay
+
+
+@scheduler.tagged('reply', REPLY)
+def send_reply(job):
+    '''Posts a composed chain of replies, each answering the one before'''
+    item, reply_texts, okay = job
+    parent = item.origin
+    for reply_text in reply_texts:
+        parent = post_reply(parent, reply_text)
+    lprint("{} resolving request: {} ({} replies).".format(
+        "Successfully" if okay else "Questionably", item, len(reply_texts)))
+    if not okay:
+        item.log(_log_dir, "nothing to parse")
+    return item
+
+
+def post_reply(parent, reply_text):
+    '''Replies to parent, waiting out reddit's rate limit; returns the
+    new comment or message'''
+    for attempt in range(_reply_attempts):
+        try:
+            return parent.reply(reply_text)
+        except praw.exceptions.APIException as e:
+            if e.error_type != 'RATELIMIT' or attempt == _reply_attempts - 1:
+                raise
+            wait = ratelimit_wait(e.message)
+            lprint("Rate limited; retrying reply in {} s.".format(wait))
+            time.sleep(wait)
+
+
+def ratelimit_wait(message):
+    '''Seconds to wait from a RATELIMIT message such as "try again in
+    9 minutes."'''
+    match = re.search(r"(\d+) (minute|second)", message or "")
+    if not match:
+        return _max_ratelimit_wait
+    seconds = int(match.group(1)) * (60 if match.group(2) == "minute" else 1)
+    return min(seconds + 1, _max_ratelimit_wait)
 
 
 def BeepBoop():
@@ -211,7 +436,8 @@ def BeepBoop():
 
 
 def sign_in():
-    return praw.Reddit(user_agent='AWS:Table Genie:v0.0.1 (by /u/TableGenie')
+    return praw.Reddit(user_agent='AWS:Table Genie:v0.0.1 (by /u/TableGenie',
+                       requestor_class=ScheduledRequestor)
 
 
 def test(mens=True):
@@ -256,7 +482,7 @@ if __name__=="__main__":
         r = sign_in()
         # table = find_table(r, sys.argv[1])
         table = find_table(r, "caravan", "3re16q")
-        print json.loads(json.dumps(table.for_json()))
+        print(json.dumps(table.for_json(), indent=2, sort_keys=True))
         # if table:
         #     pprint(table.for_json())
         # main(search_word=sys.argv[1])
@@ -0,0 +1,67 @@
+'''What scan_submissions has already looked at, kept across restarts.
+
+main() is left to die and be revived by cron, so the state lives in a
+small JSON file: the fullname of the newest submission scanned (the
+watermark) and a bounded, least-recently-seen-first set of submission
+ids.  A pass only needs to list what is newer than the watermark, and
+anything listed again is skipped without being parsed.
+'''
+import json
+import os
+from collections import OrderedDict
+
+from utils import lprint
+
+_state_path = "./scan_state.json"
+_seen_max_len = 5000
+
+
+class ScanState(object):
+    def __init__(self, path=_state_path, max_seen=_seen_max_len):
+        self.path = path
+        self.max_seen = max_seen
+        self.watermark = None
+        self.seen = OrderedDict()
+        # Per-process bookkeeping for roll_one.new_submissions
+        self.passes = 0
+        self.full_scan_due = False
+        self.load()
+
+    def __repr__(self):
+        return '<ScanState: {} seen, watermark {}>'.format(
+            len(self.seen), self.watermark)
+
+    def __contains__(self, sub_id):
+        return sub_id in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, sub_id):
+        '''Marks sub_id seen, evicting the least recently seen id if full'''
+        self.seen.pop(sub_id, None)
+        self.seen[sub_id] = True
+        while len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+
+    def advance(self, fullname):
+        self.watermark = fullname
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                lprint("Could not load scan state; starting fresh: {}".format(e))
+            return
+        self.watermark = data.get('watermark')
+        for sub_id in data.get('seen', [])[-self.max_seen:]:
+            self.seen[sub_id] = True
+
+    def save(self):
+        '''Writes the state atomically, so a kill mid-write loses nothing'''
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(watermark=self.watermark, seen=list(self.seen)), f)
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,161 @@
+'''Inverted index over table headers with ranked top-k search.
+
+Headers (and optionally item text) are broken into word terms and
+character trigrams.  A query is scored against the postings of its own
+terms only, so the cost of a search follows the number of tables that
+share a word with the query rather than the size of the corpus.  Query
+words that match no indexed word fall back to their trigrams, which
+lets partial words such as "carav" still find "Caravan".
+
+rank() holds the scoring; HeaderIndex is the in-memory postings source
+and table_store.TableStore the on-disk one.  rank() gives every table
+the same score score() would, so a query finds the same tables whether
+it is answered from an index or by scoring tables one at a time.
+'''
+import heapq
+import re
+from collections import defaultdict, namedtuple
+
+_word_re = re.compile(r"\w+", re.U)
+
+_word_weight = 1.0
+_item_weight = 0.2
+
+# Terms found in more tables than this are only used to re-score
+# candidates found by rarer terms, never to find new ones, so a query
+# on "table" does not walk every posting list in the corpus.
+_common_df = 2000
+
+# Least score for a table to count as a match, in rank() and in
+# lookup.matches alike
+_min_score = 0.75
+
+# score, the key the table was indexed under (a (sub_id, position)
+# pair for stored tables), and the Table itself
+Match = namedtuple('Match', 'score key table')
+
+
+def words(text):
+    return _word_re.findall(text.lower())
+
+
+def trigrams(word):
+    if len(word) <= 3:
+        return [word]
+    return [word[i:i+3] for i in range(len(word) - 2)]
+
+
+def table_terms(table, items=False):
+    '''Returns {term: weight} for table's header, and item text if asked'''
+    terms = {}
+    for weight, text in _indexed_text(table, items):
+        for word in words(text):
+            key = 'w:' + word
+            terms[key] = max(terms.get(key, 0), weight)
+            for gram in trigrams(word):
+                key = 'g:' + gram
+                terms[key] = max(terms.get(key, 0), weight)
+    return terms
+
+
+def _indexed_text(table, items):
+    yield _word_weight, table.header
+    if items:
+        for item in table.outcomes:
+            yield _item_weight, item.outcome
+
+
+def query_terms(query, df):
+    '''Returns {term: weight} for query; df(term) is the number of
+    indexed tables containing term.'''
+    terms = {}
+    for word in words(query):
+        if df('w:' + word):
+            terms['w:' + word] = _word_weight
+        else:
+            grams = trigrams(word)
+            for gram in grams:
+                terms['g:' + gram] = _word_weight / len(grams)
+    return terms
+
+
+def score(query, table, items=False):
+    '''Relevance of a single table to query, without corpus statistics:
+    the share of the query's words found in the table, from 0 to 1.  A
+    word missing from the table counts by the share of its trigrams
+    that are present.'''
+    terms = table_terms(table, items)
+    wanted = query_terms(query, terms.get)
+    if not wanted:
+        return 0.0
+    found = sum(weight * terms[term] for term, weight in wanted.items()
+                if term in terms)
+    return found / (_word_weight * len(set(words(query))))
+
+
+def rank(query, source, k=10, min_score=_min_score):
+    '''Top k Matches for query scoring at least min_score, best first;
+    ties go to the newest table.  source supplies total(), df(term),
+    postings(term, keys=None) yielding (key, weight) pairs and
+    table(key), and may supply created(keys), {key: creation time}.
+    Without it, ties go to the lowest key.'''
+    if not source.total():
+        return []
+    terms = query_terms(query, source.df)
+    # Normalised as in score(): the share of the query's words found
+    wanted = _word_weight * len(set(words(query)))
+    if not wanted:
+        return []
+    counted = sorted((source.df(term), term) for term in terms)
+    found = defaultdict(float)
+    for df, term in counted:
+        if not df:
+            continue
+        keys = None
+        if df > _common_df and found:
+            keys = list(found)
+        for key, weight in source.postings(term, keys):
+            found[key] += terms[term] * weight
+    scores = dict((key, total / wanted) for key, total in found.items()
+                  if total / wanted >= min_score)
+    created = getattr(source, 'created', None)
+    times = created(list(scores)) if created and scores else {}
+    best = heapq.nsmallest(k, scores, key=lambda key: (-scores[key], -times.get(key, 0), key))
+    return [Match(scores[key], key, source.table(key)) for key in best]
+
+
+class HeaderIndex(object):
+    '''In-memory postings for a list of Tables, keyed by their position
+    unless add() is given another key.'''
+    def __init__(self, tables=(), items=False):
+        self.items = items
+        self._postings = defaultdict(dict)
+        self._tables = {}
+        for position, table in enumerate(tables):
+            self.add(position, table)
+
+    def __repr__(self):
+        return '<HeaderIndex of {} tables>'.format(len(self._tables))
+
+    def add(self, key, table):
+        self._tables[key] = table
+        for term, weight in table_terms(table, self.items).items():
+            self._postings[term][key] = weight
+
+    def search(self, query, k=10):
+        return rank(query, self, k)
+
+    def total(self):
+        return len(self._tables)
+
+    def df(self, term):
+        return len(self._postings.get(term, ()))
+
+    def postings(self, term, keys=None):
+        posting = self._postings.get(term, {})
+        if keys is None:
+            return posting.items()
+        return [(key, posting[key]) for key in keys if key in posting]
+
+    def table(self, key):
+        return self._tables[key]
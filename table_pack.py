@@ -0,0 +1,350 @@
+'''Packed, memory-mappable table format.
+
+A table pack is one file of fixed-size little-endian records and a
+UTF-8 string blob:
+
+    header    magic, version, section counts and offsets
+    tables    die, first item, item count, header string, submission
+              id string, position, submission creation time (keyed
+              tables sorted by id/position, inline sub-tables after them)
+    items     cumulative weight, outcome string, inline sub-table index
+    terms     search_index terms, sorted, each with its postings range
+    postings  table index and weight
+    strings   every string above
+
+TablePack maps the file and reads only the records a query touches: a
+key lookup or a term is a binary search, a roll is a bisect over one
+table's cumulative weights, and search() runs search_index.rank over
+the packed postings.  No Python objects are built for the rest of the
+corpus, so a process can open a pack of the whole subreddit and answer
+at once.
+
+    python table_pack.py build STORE PACK
+    python table_pack.py search PACK TERM...
+'''
+from __future__ import print_function
+
+import argparse
+import mmap
+import random
+import struct
+from collections import namedtuple
+
+from search_index import rank, table_terms
+
+_magic = b'TPAK'
+_version = 2
+
+_header = struct.Struct('<4sIIIIIIIIIII')
+_table = struct.Struct('<iIIIIIIId')
+_item = struct.Struct('<IIIi')
+_term = struct.Struct('<IIII')
+_posting = struct.Struct('<If')
+
+_max_int = 2 ** 31 - 1
+_max_uint = 2 ** 32 - 1
+
+# The result of TablePack.roll; sub is the roll of an inline sub-table
+PackRoll = namedtuple('PackRoll', 'die rolled header outcome sub')
+
+
+def _utf8(text):
+    return text if isinstance(text, bytes) else text.encode('utf8')
+
+
+class _Strings(object):
+    def __init__(self):
+        self.blob = bytearray()
+
+    def add(self, text):
+        data = _utf8(text)
+        offset = len(self.blob)
+        self.blob.extend(data)
+        return offset, len(data)
+
+
+def packable(table):
+    '''Whether table and its inline sub-tables fit the pack's records:
+    a die that fits an int32, and cumulative weights that never fall
+    and fit a uint32, which a reversed range such as 10-1. breaks'''
+    if table.die is not None and not 0 <= table.die <= _max_int:
+        return False
+    cumulative = 0
+    for item in table.outcomes:
+        if item.weight < 0:
+            return False
+        cumulative += item.weight
+        if item.inline_table is not None and not packable(item.inline_table):
+            return False
+    return cumulative <= _max_uint
+
+
+def write_pack(path, keyed_tables, created=None):
+    '''Writes ((sub_id, position), Table) pairs to a pack at path, with
+    created, {key: submission creation time}, for breaking search ties;
+    returns the number of keyed tables written.  Tables that are not
+    packable() are left out.'''
+    keyed = sorted((kt for kt in keyed_tables if packable(kt[1])), key=lambda kt: kt[0])
+    created = created or {}
+    strings = _Strings()
+    tables = []
+    items = []
+    postings = {}
+
+    def add_table(table, sub_id, position, time=0.0):
+        first = len(items)
+        cumulative = 0
+        for item in table.outcomes:
+            cumulative += item.weight
+            items.append([cumulative, strings.add(item.outcome), -1])
+        die = table.die if table.die is not None else -1
+        tables.append((die, first, len(table.outcomes), strings.add(table.header),
+                       strings.add(sub_id), position, time))
+        return len(tables) - 1
+
+    def add_inline(table, first):
+        for offset, item in enumerate(table.outcomes):
+            if item.inline_table is not None:
+                sub = add_table(item.inline_table, '', 0)
+                items[first + offset][2] = sub
+                add_inline(item.inline_table, tables[sub][1])
+
+    # Keyed tables take the first slots, in key order, so keys can be
+    # binary searched; inline sub-tables follow them.
+    for (sub_id, position), table in keyed:
+        index = add_table(table, sub_id, position, created.get((sub_id, position), 0.0))
+        for term, weight in table_terms(table).items():
+            postings.setdefault(_utf8(term), []).append((index, weight))
+    for index, (_, table) in enumerate(keyed):
+        add_inline(table, tables[index][1])
+
+    term_records = []
+    posting_records = []
+    for term in sorted(postings):
+        term_records.append((strings.add(term), len(posting_records), len(postings[term])))
+        posting_records.extend(postings[term])
+
+    tables_off = _header.size
+    items_off = tables_off + _table.size * len(tables)
+    terms_off = items_off + _item.size * len(items)
+    postings_off = terms_off + _term.size * len(term_records)
+    strings_off = postings_off + _posting.size * len(posting_records)
+    with open(path, 'wb') as f:
+        f.write(_header.pack(_magic, _version, len(tables), len(keyed), len(items),
+                             len(term_records), len(posting_records), tables_off,
+                             items_off, terms_off, postings_off, strings_off))
+        for die, first, count, (h_off, h_len), (s_off, s_len), position, time in tables:
+            f.write(_table.pack(die, first, count, h_off, h_len, s_off, s_len,
+                                position, time))
+        for cumulative, (o_off, o_len), sub in items:
+            f.write(_item.pack(cumulative, o_off, o_len, sub))
+        for (t_off, t_len), first, count in term_records:
+            f.write(_term.pack(t_off, t_len, first, count))
+        for index, weight in posting_records:
+            f.write(_posting.pack(index, weight))
+        f.write(bytes(strings.blob))
+    return len(keyed)
+
+
+class PackedTable(object):
+    '''A view of one table in a TablePack; nothing is copied out of the
+    pack until an attribute is read.'''
+    __slots__ = ('pack', 'index')
+
+    def __init__(self, pack, index):
+        self.pack = pack
+        self.index = index
+
+    def __repr__(self):
+        return '<PackedTable {} with header: {}>'.format(self.index, self.header)
+
+    @property
+    def header(self):
+        return self.pack.header(self.index)
+
+    @property
+    def die(self):
+        return self.pack.die(self.index)
+
+    @property
+    def key(self):
+        return self.pack.key(self.index)
+
+    def roll(self, rng=None):
+        return self.pack.roll(self.index, rng)
+
+    def for_json(self):
+        return self.pack.for_json(self.index)
+
+
+class TablePack(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_tables, self.n_keyed, self.n_items, self.n_terms,
+         self.n_postings, self._tables_off, self._items_off, self._terms_off,
+         self._postings_off, self._strings_off) = _header.unpack_from(self._mm, 0)
+        if magic != _magic or version != _version:
+            raise ValueError('{} is not a version {} table pack'.format(path, _version))
+
+    def __repr__(self):
+        return '<TablePack of {} tables at {}>'.format(self.n_keyed, self.path)
+
+    def __len__(self):
+        return self.n_keyed
+
+    def close(self):
+        self._mm.close()
+
+    def _string(self, offset, length):
+        start = self._strings_off + offset
+        return self._mm[start:start + length].decode('utf8')
+
+    def _table(self, index):
+        return _table.unpack_from(self._mm, self._tables_off + _table.size * index)
+
+    def _item(self, index):
+        return _item.unpack_from(self._mm, self._items_off + _item.size * index)
+
+    def _term(self, index):
+        return _term.unpack_from(self._mm, self._terms_off + _term.size * index)
+
+    def header(self, index):
+        record = self._table(index)
+        return self._string(record[3], record[4])
+
+    def die(self, index):
+        die = self._table(index)[0]
+        return die if die >= 0 else None
+
+    def key(self, index):
+        record = self._table(index)
+        return self._string(record[5], record[6]), record[7]
+
+    def lookup(self, sub_id, position):
+        '''PackedTable stored under (sub_id, position), or None'''
+        wanted = (sub_id, position)
+        low, high = 0, self.n_keyed
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_keyed and self.key(low) == wanted:
+            return PackedTable(self, low)
+        return None
+
+    def roll(self, index, rng=None):
+        '''Rolls table index once; None if the table cannot be rolled'''
+        die, first, count = self._table(index)[:3]
+        if die <= 0 or not count:
+            return None
+        rng = rng or random
+        rolled = rng.randint(1, die)
+        low, high = first, first + count
+        while low < high:
+            middle = (low + high) // 2
+            if self._item(middle)[0] < rolled:
+                low = middle + 1
+            else:
+                high = middle
+        if low == first + count:
+            return None
+        _, o_off, o_len, sub = self._item(low)
+        return PackRoll(die, rolled, self.header(index), self._string(o_off, o_len),
+                        self.roll(sub, rng) if sub >= 0 else None)
+
+    def for_json(self, index):
+        '''The same shape as Table.for_json'''
+        die, first, count = self._table(index)[:3]
+        items = []
+        previous = 0
+        for i in range(first, first + count):
+            cumulative, o_off, o_len, sub = self._item(i)
+            if sub >= 0:
+                items.append(self.for_json(sub))
+            else:
+                items.append(dict(value=self._string(o_off, o_len),
+                                  weight=cumulative - previous))
+            previous = cumulative
+        return dict(die=self.die(index), header=self.header(index), items=items)
+
+    def search(self, search_term, k=10):
+        '''Top k search_index.Match results, keyed by table index'''
+        return rank(search_term, self, k)
+
+    # Postings source for search_index.rank
+
+    def _find_term(self, term):
+        wanted = _utf8(term)
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            t_off, t_len = self._term(middle)[:2]
+            start = self._strings_off + t_off
+            if self._mm[start:start + t_len] < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_terms:
+            t_off, t_len, first, count = self._term(low)
+            start = self._strings_off + t_off
+            if self._mm[start:start + t_len] == wanted:
+                return first, count
+        return 0, 0
+
+    def total(self):
+        return self.n_keyed
+
+    def df(self, term):
+        return self._find_term(term)[1]
+
+    def postings(self, term, keys=None):
+        first, count = self._find_term(term)
+        found = [_posting.unpack_from(self._mm, self._postings_off + _posting.size * i)
+                 for i in range(first, first + count)]
+        if keys is None:
+            return found
+        keys = set(keys)
+        return [(index, weight) for index, weight in found if index in keys]
+
+    def table(self, key):
+        return PackedTable(self, key)
+
+    def created(self, keys):
+        return dict((index, self._table(index)[8]) for index in keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='pack every table in a table store')
+    build.add_argument('store')
+    build.add_argument('pack')
+    search = commands.add_parser('search', help='search a pack and roll the best match')
+    search.add_argument('pack')
+    search.add_argument('term', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from table_store import TableStore
+        store = TableStore(args.store)
+        keyed = list(store.all_tables())
+        count = write_pack(args.pack, keyed, store.created([key for key, _ in keyed]))
+        print("Packed {} tables into {}, leaving out {} that do not fit".format(
+            count, args.pack, len(keyed) - count))
+    elif args.command == 'search':
+        pack = TablePack(args.pack)
+        for match in pack.search(" ".join(args.term), 5):
+            print("{:6.2f}  {}  {}".format(match.score, match.table.key, match.table.header))
+        matches = pack.search(" ".join(args.term), 1)
+        if matches:
+            print(matches[0].table.roll())
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
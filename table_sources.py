@@ -1,10 +1,23 @@
 import re
-import pickle
 
 import praw
+import prawcore
 
-from tables import Table, _trash, _header_regex, _summons_regex
-from utils import ioencode, get_post_text, lprint, fdate
+from tables import _summons_regex
+from utils import ioencode, get_post_text, lprint
+from ratelimit import scheduler
+import metrics
+import failure_log
+import parse_cache
+import comment_walk
+import link_resolver
+
+
+def permalink(comment):
+    '''A comment's permalink without fetching anything; praw 4 has a
+    method where later versions have an attribute'''
+    link = comment.permalink
+    return link(fast=True) if callable(link) else link
 
 
 class TableSource(object):
@@ -19,37 +32,32 @@ class TableSource(object):
         return ioencode('<TableSource from {}>'.format(self.desc))
 
     def roll(self):
+        blocks = self.roll_blocks()
+        return "".join(blocks) if blocks else None
+
+    def roll_blocks(self):
+        '''Rolls every table; one rendered block per successful roll,
+        the first headed by where the tables came from'''
         instance = [T.roll() for T in self.tables]
         # Prune failed rolls
-        instance = [x for x in instance if x]
-        if instance:
-            ret = "From {}...\n\n".format(self.desc)
-            for item in instance:
-                ret += item.unpack()
-            return ret
-        return None
+        blocks = [x.unpack() for x in instance if x]
+        if blocks:
+            blocks[0] = "From {}...\n\n".format(self.desc) + blocks[0]
+        return blocks
 
     def has_tables(self):
         return 0 < len(self.tables)
 
     def _parse(self):
-        indices = []
-        text = get_post_text(self.source)
-        lines = text.split("\n")
-        for line_num in range(len(lines)):
-            l = lines[line_num]
-            if re.search(_header_regex, l.strip(_trash)):
-                indices.append(line_num)
-        # TODO: if no headers found?
-        if len(indices) == 0:
-            return None
-
-        table_text = []
-        for i in range(len(indices) - 1):
-            table_text.append("\n".join(lines[indices[i]:indices[i+1]]))
-        table_text.append("\n".join(lines[indices[-1]:]))
+        with metrics.timer('fetch'):
+            text = self._get_text()
+        with metrics.timer('parse'):
+            self.tables = parse_cache.parse(text)
+        metrics.count('sources_parsed')
+        metrics.count('tables_parsed', len(self.tables))
 
-        self.tables = [Table(t) for t in table_text]
+    def _get_text(self):
+        return get_post_text(self.source)
 
 
 class TableSourceFromText(TableSource):
@@ -60,24 +68,8 @@ class TableSourceFromText(TableSource):
 
         self._parse()
 
-    # This is nearly identical to TableSource._parse ; if this is ever
-    # used outside of testing, it behooves me to make a single
-    # unifying method
-    def _parse(self):
-        indices = []
-        text = self.text
-        lines = text.split("\n")
-        for line_num in range(len(lines)):
-            l = lines[line_num]
-            if re.search(_header_regex, l.strip(_trash)):
-                indices.append(line_num)
-        if len(indices) == 0:
-            return None
-        table_text = []
-        for i in range(len(indices) - 1):
-            table_text.append("\n".join(lines[indices[i]:indices[i+1]]))
-        table_text.append("\n".join(lines[indices[-1]:]))
-        self.tables = [Table(t) for t in table_text]
+    def _get_text(self):
+        return self.text
 
 
 class Request:
@@ -93,9 +85,9 @@ class Request:
         return ioencode("<Request from >".format(str(self)))
 
     def __str__(self):
-        if type(self.origin) == praw.models.Comment:
+        if isinstance(self.origin, praw.models.Comment):
             via = "mention in {}".format(self.origin.submission.title)
-        elif type(self.origin) == praw.models.Message:
+        elif isinstance(self.origin, praw.models.Message):
             via = "private message"
         else:
             via = "a mystery!"
@@ -119,77 +111,63 @@ class Request:
         if table_source.has_tables():
             self.tables_sources.append(table_source)
 
+    @scheduler.tagged('link sources')
     def get_link_sources(self):
-        links = re.findall("\[.*?\]\s*\(.*?\)", self.origin.body)
-        for item in links:
-            desc, href = re.search("\[(.*?)\]\s*\((.*?)\)", item).groups()
-            href = href.strip()
-            if "reddit.com" in href.lower():
-                lprint("Fetching href: {}".format(href.lower()))
-                if "m.reddit" in href.lower():
-                    lprint("Removing mobile 'm.'")
-                    href = href.lower().replace("m.reddit", "reddit", 1)
-                if ".json" in href.lower():
-                    lprint("Pruning .json and anything beyond.")
-                    href = href[:href.find('.json')]
-                if not 'www' in href.lower():
-                    lprint("Injecting 'www.' to href")
-                    href = href[:href.find("reddit.com")] + 'www.' + href[href.find("reddit.com"):]
-                href = href.rstrip("/")
-                lprint("Processing href: {}".format(href))
-                self._maybe_add_source(
-                    self.reddit.get_submission(href),
-                    desc)
-
-    def get_default_sources(self):
-        '''Default sources are OP and top-level comments'''
-        try:
-            # Add OP
-            self._maybe_add_source(self.origin.submission, "this thread's original post")
-            # Add Top-level comments
-            top_level_comments = self.reddit.get_submission(None, self.origin.submission.id).comments
-            for item in top_level_comments:
-                self._maybe_add_source(item, "[this]({}) comment by {}".format(item.permalink, item.author) )
-        except:
+        '''Sources are the reddit posts linked from the request, each
+        fetched once, together; see link_resolver'''
+        for desc, item in link_resolver.resolve_links(self.reddit, self.origin.body):
+            lprint("Resolved link [{}] to {}".format(desc, item.fullname))
+            self._maybe_add_source(item, desc)
+
+    @scheduler.tagged('thread sources')
+    def get_default_sources(self, budget=None):
+        '''Default sources are OP and the thread's comments, at any
+        depth, that look like they hold tables; see comment_walk for
+        the order they are searched in and the budget that bounds it.'''
+        if not isinstance(self.origin, praw.models.Comment):
             lprint("Could not add default sources.  (PM without links?)")
+            return
+        try:
+            submission = self.origin.submission
+            self._maybe_add_source(submission, "this thread's original post")
+            for item in comment_walk.walk(submission, budget):
+                self._maybe_add_source(item, "[this]({}) comment by {}".format(
+                    permalink(item), item.author))
+        except (praw.exceptions.PRAWException, prawcore.PrawcoreException) as e:
+            # Keep whatever was found before the failure; with nothing
+            # found, let process_mail retry or log the request
+            if not self.tables_sources:
+                raise
+            lprint("Could not add all default sources: {}".format(e))
 
     def roll(self):
-        instance = [TS.roll() for TS in self.tables_sources]
-        instance = [x for x in instance if x]
-        return "\n\n-----\n\n".join(instance)
+        return "".join(self.roll_blocks())
+
+    def roll_blocks(self):
+        '''Rendered blocks of every source's rolls, a rule between
+        sources; a reply may be split between any two blocks'''
+        blocks = []
+        for TS in self.tables_sources:
+            source_blocks = TS.roll_blocks()
+            if source_blocks and blocks:
+                source_blocks[0] = "\n\n-----\n\n" + source_blocks[0]
+            blocks.extend(source_blocks)
+        return blocks
 
     def reply(self, reply_text):
-        self.origin.reply(reply_text)
+        return self.origin.reply(reply_text)
 
     def is_summons(self):
         return re.search(_summons_regex, get_post_text(self.origin).lower())
 
     def is_PM(self):
-        return type(self.origin) == praw.models.Message
-
-    def log(self, log_dir):
-        filename = "{}/rofm-{}-{}.log".format(log_dir, self.origin.author, self.origin.fullname)
-        with open(filename, 'w') as f:
-            f.write("Time    :  {}\n".format(fdate() ))
-            f.write("Author  :  {}\n".format(self.origin.author))
-            try:
-                f.write("Link    :  {}\n".format(self.origin.permalink))
-            except:
-                f.write("Link    :  Unavailable (PM?)\n")
-            f.write("Type    :  {}\n".format(type(self.origin)))
-            try:
-                f.write("Body    : (below)\n[Begin body]\n{}\n[End body]\n".format( get_post_text(self.origin)))
-            except:
-                f.write("Body    : Could not resolve message body.")
-            f.write("\n")
-            try:
-                f.write("Submission title : {}\n".format(self.origin.submission.title))
-                f.write("Submission body  : (below)\n[Begin selftext]\n{}\n[End selftext]\n".format(self.origin.submission.selftext))
-            except:
-                f.write("Submission: Could not resolve submission.")
-        filename = filename.rstrip("log") + "pickle"
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
+        return isinstance(self.origin, praw.models.Message)
+
+    def log(self, log_dir, reason="unanswered"):
+        '''Queues a record of this request for failure_log's writer
+        in log_dir; nothing is fetched or written on this thread'''
+        failure_log.writer(log_dir).put(
+            failure_log.record(self.origin, reason, self.tables_sources))
 
     # This function is unused, but may be useful in future logging
     def describe_source(self):
@@ -0,0 +1,329 @@
+'''On-disk store of parsed tables, keyed by submission id and edit time.
+
+Each submission's tables are parsed once and kept in SQLite, so
+find_table can answer from a single query instead of re-fetching and
+re-parsing the whole subreddit listing on every call.  refresh() only
+parses submissions that are new or have been edited since they were
+stored.
+
+Headers are indexed into a terms table as they are stored, and
+search() ranks them through search_index.rank, so a lookup reads only
+the postings of the query's own terms.
+'''
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+
+import praw
+import prawcore
+
+from tables import Table
+from table_sources import TableSource
+from search_index import rank, table_terms
+from utils import lprint
+
+# Lambda can only write under /tmp, so default there; override with
+# TABLE_STORE for a persistent location.
+_store_path = os.environ.get(
+    'TABLE_STORE', os.path.join(tempfile.gettempdir(), 'table_genie.sqlite'))
+
+# Bump whenever _schema changes; a store with another version is
+# dropped and rebuilt, since everything in it can be re-parsed.
+_schema_version = 2
+
+# Comments (from ingest.py archives) are stored under their fullname,
+# so their ids cannot collide with submission ids
+_comment_prefix = 't1_'
+
+# Tables built from stored text, kept so a popular table is neither
+# re-parsed nor re-serialised on every request
+_table_cache_size = 256
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY,
+    edited REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_created ON submissions (created);
+CREATE TABLE IF NOT EXISTS tables (
+    sub_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    die INTEGER,
+    header TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (sub_id, position)
+);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    sub_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    weight REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS terms_term ON terms (term, sub_id);
+CREATE INDEX IF NOT EXISTS terms_sub ON terms (sub_id);
+CREATE TABLE IF NOT EXISTS df (
+    term TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+'''
+
+_drop = '''
+DROP TABLE IF EXISTS submissions;
+DROP TABLE IF EXISTS tables;
+DROP TABLE IF EXISTS terms;
+DROP TABLE IF EXISTS df;
+DROP TABLE IF EXISTS meta;
+'''
+
+
+def store_key(item):
+    '''The key item's tables are stored under: a submission's id, or a
+    comment's fullname'''
+    if isinstance(item, praw.models.Comment):
+        return _comment_prefix + item.id
+    return item.id
+
+
+def reddit_fullname(key):
+    '''The reddit fullname of the submission or comment stored under key'''
+    return key if key.startswith(_comment_prefix) else 't3_' + key
+
+
+def edit_stamp(submission):
+    '''praw reports edited as False, or the time of the last edit'''
+    return float(submission.edited or 0)
+
+
+def rows(sub_id, tables, items=False):
+    '''(table rows, term rows) to store tables under sub_id.  This is
+    the CPU-bound part of storing, kept free of the database so parse
+    workers in other processes can do it.'''
+    table_rows = []
+    term_rows = []
+    for position, table in enumerate(tables):
+        table_rows.append((sub_id, position, table.die, table.header, table.text))
+        for term, weight in table_terms(table, items).items():
+            term_rows.append((term, sub_id, position, weight))
+    return table_rows, term_rows
+
+
+class TableStore(object):
+    def __init__(self, path=_store_path, items=False):
+        self.path = path
+        self.items = items
+        self._tables = OrderedDict()
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_schema)
+        if self._meta('version') != _schema_version:
+            self.db.executescript(_drop + _schema)
+            self._set_meta('version', _schema_version)
+
+    def __repr__(self):
+        return '<TableStore at {}>'.format(self.path)
+
+    def close(self):
+        self.db.close()
+
+    def is_current(self, sub_id, edited):
+        row = self.db.execute('SELECT edited FROM submissions WHERE id = ?',
+                              (sub_id,)).fetchone()
+        return row is not None and row[0] >= edited
+
+    def put(self, sub_id, edited, created, tables):
+        '''Replaces whatever is stored for sub_id with tables'''
+        table_rows, term_rows = rows(sub_id, tables, self.items)
+        self.put_rows([(sub_id, edited, created, table_rows, term_rows)])
+
+    def put_rows(self, entries):
+        '''Stores (sub_id, edited, created, table_rows, term_rows) entries,
+        as built by rows(), in a single transaction'''
+        with self.db:
+            total = self.total()
+            for sub_id, edited, created, table_rows, term_rows in entries:
+                total += len(table_rows) - self._delete(sub_id)
+                self.db.execute('INSERT OR REPLACE INTO submissions VALUES (?, ?, ?)',
+                                (sub_id, edited, created))
+                self.db.executemany('INSERT INTO tables VALUES (?, ?, ?, ?, ?)',
+                                    table_rows)
+                self.db.executemany('INSERT INTO terms VALUES (?, ?, ?, ?)', term_rows)
+                self.db.executemany('INSERT OR IGNORE INTO df VALUES (?, 0)',
+                                    [(t[0],) for t in term_rows])
+                self.db.executemany('UPDATE df SET n = n + 1 WHERE term = ?',
+                                    [(t[0],) for t in term_rows])
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                            ('tables', total))
+
+    def _delete(self, sub_id):
+        '''Drops sub_id's tables and their terms; returns how many tables'''
+        removed = self.db.execute('SELECT COUNT(*) FROM tables WHERE sub_id = ?',
+                                  (sub_id,)).fetchone()[0]
+        self.db.execute(
+            'UPDATE df SET n = n - (SELECT COUNT(*) FROM terms t'
+            ' WHERE t.term = df.term AND t.sub_id = ?)'
+            ' WHERE term IN (SELECT term FROM terms WHERE sub_id = ?)',
+            (sub_id, sub_id))
+        self.db.execute('DELETE FROM terms WHERE sub_id = ?', (sub_id,))
+        self.db.execute('DELETE FROM tables WHERE sub_id = ?', (sub_id,))
+        return removed
+
+    def refresh(self, submissions, mark=True):
+        '''Parses and stores each of submissions that is new or edited;
+        returns how many were parsed.  Unless mark is False (the
+        submissions are not the whole listing), the store then counts
+        as fresh.'''
+        parsed = 0
+        for item in submissions:
+            key = store_key(item)
+            edited = edit_stamp(item)
+            if self.is_current(key, edited):
+                continue
+            try:
+                TS = TableSource(item, "scan")
+                self.put(key, edited, item.created_utc, TS.tables)
+            except prawcore.PrawcoreException:
+                raise
+            except Exception as e:
+                # A post that can't be parsed or stored is tried again
+                # on the next refresh; the rest of the listing goes on
+                lprint('Could not store submission {}: {!r}'.format(key, e))
+                continue
+            parsed += 1
+        if mark:
+            self.mark_refreshed()
+        lprint('Table store refresh parsed {} submissions.'.format(parsed))
+        return parsed
+
+    def mark_refreshed(self):
+        '''Records that the store now holds the whole current listing'''
+        self._set_meta('refreshed', time.time())
+
+    def age(self):
+        '''Seconds since the last refresh; None if never refreshed'''
+        refreshed = self._meta('refreshed')
+        return time.time() - refreshed if refreshed is not None else None
+
+    def _meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                            (key, value))
+
+    def tables(self, sub_id):
+        rows = self.db.execute(
+            'SELECT text FROM tables WHERE sub_id = ? ORDER BY position',
+            (sub_id,))
+        return [self._table(text) for (text,) in rows]
+
+    def all_tables(self):
+        '''((sub_id, position), Table) for every stored table'''
+        rows = self.db.execute('SELECT sub_id, position, text FROM tables')
+        for sub_id, position, text in rows:
+            yield (sub_id, position), Table(text)
+
+    def search(self, search_term, k=10, sub_id=None):
+        '''Top k search_index.Match results for search_term, keyed by
+        (sub_id, position).  sub_id limits the search to one submission.'''
+        if sub_id:
+            return _SubmissionView(self, sub_id).search(search_term, k)
+        return rank(search_term, self, k)
+
+    def find(self, search_term, sub_id=None):
+        '''Best matching table for search_term, or None'''
+        matches = self.search(search_term, 1, sub_id)
+        return matches[0].table if matches else None
+
+    # Postings source for search_index.rank
+
+    def total(self):
+        return int(self._meta('tables') or 0)
+
+    def df(self, term):
+        row = self.db.execute('SELECT n FROM df WHERE term = ?', (term,)).fetchone()
+        return row[0] if row else 0
+
+    def postings(self, term, keys=None):
+        if keys is None:
+            rows = self.db.execute(
+                'SELECT sub_id, position, weight FROM terms WHERE term = ?', (term,))
+            return [((sub, pos), weight) for sub, pos, weight in rows]
+        keys = set(keys)
+        subs = list(set(sub for sub, _ in keys))
+        rows = []
+        # Stay under SQLite's default limit of 999 bound parameters
+        for i in range(0, len(subs), 900):
+            chunk = subs[i:i+900]
+            rows.extend(self.db.execute(
+                'SELECT sub_id, position, weight FROM terms WHERE term = ?'
+                ' AND sub_id IN ({})'.format(','.join('?' * len(chunk))),
+                [term] + chunk))
+        return [((sub, pos), weight) for sub, pos, weight in rows
+                if (sub, pos) in keys]
+
+    def table(self, key):
+        row = self.db.execute(
+            'SELECT text FROM tables WHERE sub_id = ? AND position = ?',
+            key).fetchone()
+        return self._table(row[0])
+
+    def created(self, keys):
+        '''{key: creation time of its submission} for keys'''
+        subs = list(set(sub for sub, _ in keys))
+        times = {}
+        for i in range(0, len(subs), 900):
+            chunk = subs[i:i+900]
+            times.update(self.db.execute(
+                'SELECT id, created FROM submissions WHERE id IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk))
+        return dict((key, times.get(key[0], 0)) for key in keys)
+
+    def _table(self, text):
+        '''Table(text), reused while text stays among the most recently
+        used.  Keyed by the text itself, so a re-stored (edited) table
+        is always parsed afresh.'''
+        table = self._tables.pop(text, None)
+        if table is None:
+            table = Table(text)
+        self._tables[text] = table
+        if len(self._tables) > _table_cache_size:
+            self._tables.popitem(last=False)
+        return table
+
+
+class _SubmissionView(object):
+    '''Postings source restricted to one submission's tables'''
+    def __init__(self, store, sub_id):
+        self.store = store
+        self.sub_id = sub_id
+
+    def search(self, search_term, k):
+        return rank(search_term, self, k)
+
+    def total(self):
+        return self.store.db.execute(
+            'SELECT COUNT(*) FROM tables WHERE sub_id = ?',
+            (self.sub_id,)).fetchone()[0]
+
+    def df(self, term):
+        return self.store.db.execute(
+            'SELECT COUNT(*) FROM terms WHERE term = ? AND sub_id = ?',
+            (term, self.sub_id)).fetchone()[0]
+
+    def postings(self, term, keys=None):
+        rows = self.store.db.execute(
+            'SELECT position, weight FROM terms WHERE term = ? AND sub_id = ?',
+            (term, self.sub_id))
+        return [((self.sub_id, pos), weight) for pos, weight in rows]
+
+    def table(self, key):
+        return self.store.table(key)
@@ -1,11 +1,18 @@
+import json
 import re
 import random
 import string
+from bisect import bisect_left
+from collections import namedtuple
 
+import metrics
 from utils import ioencode, lprint
 
 _last_updated = "2016-04-18"
 
+# numpy, once roll_many has tried to import it; False if it is missing
+_numpy = None
+
 _seen_max_len = 50
 _fetch_limit = 101
 
@@ -15,6 +22,38 @@ _header_regex = "^(\d+)?[dD](\d+)(.*)"
 _line_regex = "^(\d+)(\s*-+\s*\d+)?(.*)"
 _summons_regex = "u/roll_one_for_me"
 
+# A header naming a bigger die than this is not taken at its word: the
+# table gets no die and cannot be rolled.  Far above any die a post
+# lists out, and small enough for a 32-bit field.
+_max_die = 10 ** 6
+
+_header_re = re.compile(_header_regex)
+_line_re = re.compile(_line_regex)
+_inline_die_re = re.compile("[dD]\d+")
+_inline_header_re = re.compile("[dD](\d+)(.*)")
+_inline_next_re = re.compile(_line_regex[1:])
+
+# An outcome pointing at another table of the same post, by position
+# ("roll on table 3") or by a phrase from its header ("roll again on
+# the Treasure table")
+_reference_re = re.compile(
+    r"\broll (?:again |twice |once )?on (?:the )?(?:table #?(\d+)\b|(.+?) table\b)",
+    re.IGNORECASE)
+_reference_word_re = re.compile(r"\w+", re.UNICODE)
+# Words that point at a table without naming it ("roll on the table
+# below", "roll again on this table"); a reference name is taken
+# without them at either end, and names nothing if that leaves nothing
+_reference_stop_words = frozenset([
+    'a', 'an', 'the', 'this', 'that', 'these', 'those', 'same', 'other',
+    'above', 'below', 'previous', 'next', 'following', 'preceding',
+])
+
+# Rolls below a top-level roll are rendered at most this many levels
+# deep, and at most this many rolls in all
+_max_roll_depth = 8
+_max_roll_nodes = 200
+_roll_budget_note = "(Further nested rolls skipped.)    \n"
+
 _mentions_attempts = 10
 _answer_attempts = 10
 
@@ -26,72 +65,286 @@ _log_dir = "./logs"
 _trivial_passes_per_heartbeat = 30
 
 
+HEADER = 'header'
+ITEM = 'item'
+
+# A header or item line found by tokenize().  start and end are the
+# offsets of the raw line in the scanned text; match is the regex
+# match against the stripped line.
+Token = namedtuple('Token', 'kind start end match')
+
+
+def tokenize(text):
+    '''Walks text once, yielding a Token for each line that looks like a
+    table header or a table item.  Each line is stripped and matched
+    exactly once; header lines take precedence over item lines.'''
+    pos = 0
+    for raw in text.split("\n"):
+        end = pos + len(raw)
+        line = raw.strip(_trash)
+        match = _header_re.match(line)
+        if match:
+            yield Token(HEADER, pos, end, match)
+        else:
+            match = _line_re.match(line)
+            if match:
+                yield Token(ITEM, pos, end, match)
+        pos = end + 1
+
+
+def parse_tables(text):
+    '''Builds a Table for every header found in text.  Item lines that
+    precede the first header are ignored.'''
+    tables = []
+    head = None
+    items = []
+    for token in tokenize(text):
+        if token.kind == HEADER:
+            if head:
+                tables.append(_table_from_tokens(text, head, items, token.start - 1))
+            head = token
+            items = []
+        elif head:
+            items.append(token)
+    if head:
+        tables.append(_table_from_tokens(text, head, items, len(text)))
+    link_references(tables)
+    return tables
+
+
+def link_references(tables):
+    '''Points every item, inline ones included, whose outcome says to
+    roll on another of tables at that Table, so rolling it follows the
+    reference without re-parsing or re-compiling anything.'''
+    pending = [t.outcomes for t in tables]
+    while pending:
+        for item in pending.pop():
+            if item.inline_table is not None:
+                pending.append(item.inline_table.outcomes)
+            text = item.outcome
+            if item.inline_table is not None:
+                # References inside the inline table are its own items'
+                text = text[:_inline_die_re.search(text).start()]
+            match = _reference_re.search(text)
+            if match:
+                item.reference = _find_reference(tables, match)
+
+
+def _find_reference(tables, match):
+    number, name = match.groups()
+    if number:
+        index = int(number) - 1
+        return tables[index] if 0 <= index < len(tables) else None
+    words = _reference_word_re.findall(name.lower())
+    while words and words[0] in _reference_stop_words:
+        words.pop(0)
+    while words and words[-1] in _reference_stop_words:
+        words.pop()
+    if not words:
+        return None
+    # The name's words, whole and in order, somewhere in the header
+    n = len(words)
+    for table in tables:
+        header = _reference_word_re.findall(table.header.lower())
+        if any(header[i:i + n] == words for i in range(len(header) - n + 1)):
+            return table
+    return None
+
+
+def _die(digits):
+    '''The die a header names, or None if it is absurdly large'''
+    die = int(digits)
+    return die if die <= _max_die else None
+
+
+def _table_from_tokens(text, head, items, stop):
+    outcomes = [TableItem(text[t.start:t.end], match=t.match) for t in items]
+    return Table(text, head=head.match, items=outcomes, span=(head.start, stop))
+
+
+_weight_error = "[Table roll error: parsed die did not match sum of item weights.]"
+
+# The frozen roll data of a parsed Table: cumulative item weights for
+# bisect selection, plus the validation messages worked out once at
+# parse time instead of on every roll.
+CompiledTable = namedtuple('CompiledTable', 'die cumulative weight_error count_error')
+
+
+def compile_table(die, outcomes):
+    cumulative = []
+    total = 0
+    for item in outcomes:
+        total += item.weight
+        cumulative.append(total)
+    weight_error = _weight_error if die != total else None
+    count_error = None
+    if len(outcomes) != die:
+        count_error = 'Expected {} items found {}'.format(die, len(outcomes))
+    return CompiledTable(die, tuple(cumulative), weight_error, count_error)
+
+
+def _import_numpy():
+    '''numpy, or False if it is not installed; imported once'''
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
 class Table(object):
     '''Container for a single set of TableItem objects
     A single post will likely contain many Table objects'''
-    def __init__(self, text):
-        self.text = text
+    __slots__ = ('source', 'start', 'stop', 'die', 'header', 'outcomes',
+                 'is_inline', 'compiled', '_json_text', '_compact_json_text')
+
+    def __init__(self, text, head=None, items=None, span=None):
+        # The raw text is only kept as the span of the post it was
+        # parsed from, a string every table of that post shares.
+        self.source = text
+        self.start, self.stop = span or (0, len(text))
         self.die = None
         self.header = ""
         self.outcomes = []
         self.is_inline = False
-
-        self._parse()
+        # to_json() text, encoded on first use
+        self._json_text = None
+        self._compact_json_text = None
+
+        # parse_tables() hands over the header match and the already
+        # built items, so the text is not scanned a second time
+        if items is None:
+            self._parse()
+        else:
+            self._build(head, items)
+        self.compiled = compile_table(self.die, self.outcomes)
 
     def __repr__(self):
         return ioencode('<Table with header: {}>'.format(self.header))
 
+    @property
+    def text(self):
+        return self.source[self.start:self.stop]
+
     def for_json(self):
+        '''{die, header, items}, each item {value, weight} or an inline
+        table's for_json().  A new dict on every call; to_json() keeps
+        the encoded text instead.'''
         return dict(
             die=self.die,
             header=self.header,
             items=[t.for_json() for t in self.outcomes]
         )
 
+    def for_compact_json(self):
+        '''for_json() by column: {die, header, values, weights}, an
+        inline table's value being its own compact form.  weights is
+        left out when every item has weight 1.'''
+        weights = [t.weight for t in self.outcomes]
+        payload = dict(
+            die=self.die,
+            header=self.header,
+            values=[t.inline_table.for_compact_json() if t.inline_table else t.outcome
+                    for t in self.outcomes],
+        )
+        if any(w != 1 for w in weights):
+            payload['weights'] = weights
+        return payload
+
+    def to_json(self, compact=False):
+        '''for_json(), or for_compact_json() if compact, as JSON text.
+        Encoded on the first call and kept; a str cannot be modified by
+        a caller, and a re-parse builds a new Table.'''
+        if compact:
+            if self._compact_json_text is None:
+                self._compact_json_text = json.dumps(self.for_compact_json(),
+                                                     separators=(',', ':'))
+            return self._compact_json_text
+        if self._json_text is None:
+            self._json_text = json.dumps(self.for_json(), separators=(',', ':'))
+        return self._json_text
+
     def _parse(self):
         lines = self.text.split('\n')
-        head = lines.pop(0)
-        head_match = re.search(_header_regex, head.strip(_trash))
-        if head_match:
-            self.die = int(head_match.group(2))
-            self.header = head_match.group(3)
-        self.outcomes = [TableItem(l) for l in lines if re.search(_line_regex, l.strip(_trash))]
-
-    def roll(self):
+        head = _header_re.match(lines.pop(0).strip(_trash))
+        items = []
+        for l in lines:
+            match = _line_re.match(l.strip(_trash))
+            if match:
+                items.append(TableItem(l, match=match))
+        self._build(head, items)
+
+    def _build(self, head, items):
+        if head:
+            self.die = _die(head.group(2))
+            self.header = head.group(3)
+        self.outcomes = items
+
+    @metrics.timed('roll')
+    def roll(self, rng=None):
+        '''Rolls the table once.  rng is a random.Random to draw from;
+        the module-level generator is used by default.'''
+        compiled = self.compiled
         try:
-            weights = [i.weight for i in self.outcomes]
-            total_weight = sum(weights)
-            if self.die != total_weight:
-                self.header = "[Table roll error: parsed die did not match sum of item wieghts.]  \n" + self.header
-            c = random.randint(1, self.die)
-            scan = c
-            ind = -1
-            while scan > 0:
-                ind += 1
-                scan -= weights[ind]
-
-            R = TableRoll(d=self.die,
+            c = (rng or random).randint(1, compiled.die)
+            # A roll past the summed weights lands outside the table
+            # and raises IndexError below, as a bad table always has.
+            out = self.outcomes[bisect_left(compiled.cumulative, c)]
+            head = self.header
+            if compiled.weight_error:
+                head = compiled.weight_error + "  \n" + head
+            R = TableRoll(d=compiled.die,
                           rolled=c,
-                          head=self.header,
-                          out=self.outcomes[ind])
-            if len(self.outcomes) != self.die:
-                R.error('Expected {} items found {}'.format(self.die, len(self.outcomes)))
+                          head=head,
+                          out=out,
+                          rng=rng)
+            if compiled.count_error:
+                R.error(compiled.count_error)
             return R
         # TODO: Handle errors more gracefully.
         except Exception as e:
             lprint('Exception in Table roll ({}): {}'.format(self, e))
             return None
 
+    def roll_many(self, n, rng=None):
+        '''Rolls the table n times, returning a list of the index into
+        self.outcomes of each result, or None if the table cannot be
+        rolled.  When NumPy is installed the draw is vectorised; it is
+        imported on the first call, not when this module loads.  rng is
+        a random.Random, which also seeds the NumPy generator so a given
+        rng always yields the same draws.'''
+        compiled = self.compiled
+        if not compiled.die or not compiled.cumulative or \
+           compiled.die > compiled.cumulative[-1]:
+            return None
+        rng = rng or random
+        numpy = _import_numpy()
+        if numpy:
+            state = numpy.random.RandomState(rng.randint(0, 2**32 - 1))
+            rolled = state.randint(1, compiled.die + 1, size=n)
+            return numpy.searchsorted(compiled.cumulative, rolled, side='left').tolist()
+        cumulative = compiled.cumulative
+        die = compiled.die
+        randint = rng.randint
+        return [bisect_left(cumulative, randint(1, die)) for _ in range(n)]
+
 
 class TableItem(object):
     '''This class allows simple handling of in-line subtables'''
-    def __init__(self, text, w=0):
-        self.text = text
+    __slots__ = ('outcome', 'weight', 'inline_table', 'reference')
+
+    def __init__(self, text, w=0, match=None):
         self.inline_table = None
+        # Another Table of the same post; set by link_references()
+        self.reference = None
         self.outcome = ""
         self.weight = 0
 
-        self._parse()
+        # Only the parsed outcome is kept, not the raw line
+        self._parse(text, match)
 
         # If parsing fails, particularly in inline-tables, we may want
         # to explicitly set weights
@@ -109,44 +362,44 @@ class TableItem(object):
             value=self.outcome,
             weight=self.weight)
 
-    def _parse(self):
-        main_regex = re.search(_line_regex, self.text.strip(_trash))
+    def _parse(self, text, main_regex=None):
+        if main_regex is None:
+            main_regex = _line_re.match(text.strip(_trash))
         if not main_regex:
             return
+        first, last, outcome = main_regex.groups()
         # Grab outcome
-        self.outcome = main_regex.group(3).strip(_trash)
+        self.outcome = outcome.strip(_trash)
         # Get weight / ranges
-        if not main_regex.group(2):
+        if not last:
             self.weight = 1
         else:
             try:
-                start = int(main_regex.group(1).strip(_trash))
-                stop = int(main_regex.group(2).strip(_trash))
-                self.weight = stop - start + 1
+                self.weight = int(last.strip(_trash)) - int(first) + 1
             except:
                 self.weight = 1
         # Identify if there is a subtable
-        if re.search("[dD]\d+", self.outcome):
-            die_regex = re.search("[dD]\d+", self.outcome)
+        die_regex = _inline_die_re.search(self.outcome)
+        if die_regex:
             try:
                 self.inline_table = InlineTable(self.outcome[die_regex.start():])
             except RuntimeError as e:
                 lprint("Error in inline_table parsing ; table item full text:")
-                lprint(self.text)
+                lprint(text)
                 lprint(e)
                 self.outcome = self.outcome[:die_regex.start()].strip(_trash)
-        # this might be redundant
-        self.outcome = self.outcome.strip(_trash)
 
     def get(self):
         if self.inline_table:
-            return self.outcome + self.inline_table.roll()
+            return self.outcome + self.inline_table.roll().unpack()
         else:
             return self.outcome
 
 
 class InlineTable(Table):
     '''A Table object whose text is parsed in one line, instead of expecting line breaks'''
+    __slots__ = ()
+
     def __init__(self, text):
         super(InlineTable, self).__init__(text)
         self.is_inline = True
@@ -155,21 +408,21 @@ class InlineTable(Table):
         return ioencode('<d{} Inline table>'.format(self.die))
 
     def _parse(self):
-        top = re.search("[dD](\d+)(.*)", self.text)
+        top = _inline_header_re.search(self.text)
         if not top:
             return
 
-        self.die = int(top.group(1))
+        self.die = _die(top.group(1))
         tail = top.group(2)
         while tail:
-            in_match = re.search(_line_regex, tail.strip(_trash))
+            in_match = _line_re.match(tail.strip(_trash))
             if not in_match:
                 lprint("Could not complete parsing InlineTable; in_match did not catch.")
                 lprint("Returning blank roll area.")
                 self.outcomes = [TableItem("1-{}. N/A".format(self.die))]
                 return
             this_out = in_match.group(3)
-            next_match = re.search(_line_regex[1:], this_out)
+            next_match = _inline_next_re.search(this_out)
             if next_match:
                 tail = this_out[next_match.start():]
                 this_out = this_out[:next_match.start()]
@@ -184,17 +437,25 @@ class InlineTable(Table):
                 lprint("Exception:", e)
 
 
+# Marks a child roll not made yet, as None means it was made and failed
+_unrolled = object()
+
+
 class TableRoll(object):
-    def __init__(self, d, rolled, head, out, err=None):
+    '''One roll of a Table.  The outcome's inline subtable, and the
+    table it refers to, are each rolled once, when first asked for, so
+    only the part of the tree that is rendered is ever rolled.'''
+    __slots__ = ('d', 'rolled', 'head', 'out', 'err', 'rng', '_sub_roll', '_ref_roll')
+
+    def __init__(self, d, rolled, head, out, err=None, rng=None):
         self.d = d
         self.rolled = rolled
         self.head = head
         self.out = out
-        self.sub = out.inline_table
         self.err = err
-
-        if self.sub:
-            self.sob_out = self.sub.roll()
+        self.rng = rng
+        self._sub_roll = _unrolled
+        self._ref_roll = _unrolled
 
     def __repr__(self):
         return ioencode('<d{} TableRoll: {}>'.format(self.d, self.head))
@@ -202,10 +463,54 @@ class TableRoll(object):
     def error(self, e):
         self.err = e
 
-    def unpack(self):
-        ret = "{}...    \n".format(self.head.strip(_trash))
-        ret += "(d{} -> {}) {}.    \n".format(self.d, self.rolled, self.out.outcome)
-        if self.sub:
-            ret += "Subtable: {}".format(self.sub.roll().unpack())
-        ret += "\n\n"
-        return ret
+    def sub_roll(self):
+        '''Roll of the outcome's inline subtable, or None'''
+        if self._sub_roll is _unrolled:
+            sub = self.out.inline_table
+            self._sub_roll = sub.roll(self.rng) if sub is not None else None
+        return self._sub_roll
+
+    def ref_roll(self):
+        '''Roll of the table the outcome refers to, or None'''
+        if self._ref_roll is _unrolled:
+            ref = self.out.reference
+            self._ref_roll = ref.roll(self.rng) if ref is not None else None
+        return self._ref_roll
+
+    def unpack(self, max_depth=_max_roll_depth, max_nodes=_max_roll_nodes):
+        '''Renders this roll and, up to max_depth levels and max_nodes
+        rolls, the subtable and referenced-table rolls beneath it.  The
+        tree is walked with a stack into one list of parts, so the cost
+        is linear in the rolls shown, however deep they nest.'''
+        out = self.out
+        if out.inline_table is None and out.reference is None:
+            return "{}...    \n(d{} -> {}) {}.    \n\n\n".format(
+                self.head.strip(_trash), self.d, self.rolled, out.outcome)
+        parts = []
+        nodes = max_nodes - 1
+        # (roll, levels left) to render, or (text, None) to emit
+        stack = [(self, max_depth)]
+        while stack:
+            roll, depth = stack.pop()
+            if depth is None:
+                parts.append(roll)
+                continue
+            parts.append("{}...    \n".format(roll.head.strip(_trash)))
+            parts.append("(d{} -> {}) {}.    \n".format(roll.d, roll.rolled, roll.out.outcome))
+            later = []
+            for label, table, child in (
+                    ("Subtable: ", roll.out.inline_table, roll.sub_roll),
+                    ("From the referenced table: ", roll.out.reference, roll.ref_roll)):
+                if table is None:
+                    continue
+                if depth <= 1 or nodes <= 0:
+                    later.append((_roll_budget_note, None))
+                    continue
+                nodes -= 1
+                sub = child()
+                if sub is not None:
+                    later.append((label, None))
+                    later.append((sub, depth - 1))
+            later.append(("\n\n", None))
+            stack.extend(reversed(later))
+        return "".join(parts)
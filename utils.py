@@ -18,7 +18,9 @@ def pprint(obj):
 
 
 def ioencode(s):
-    return s.encode('utf8')
+    '''s as the native str that __repr__ must return: utf-8 bytes on
+    Python 2, text on Python 3'''
+    return s.encode('utf8') if str is bytes else s
 
 
 def fdate():
@@ -29,9 +31,9 @@ def fdate():
 # and give each class its own method
 def get_post_text(post):
     '''Returns text to parse from either Comment or Submission'''
-    if type(post) == praw.models.Comment:
+    if isinstance(post, praw.models.Comment):
         return post.body
-    elif type(post) == praw.models.Submission:
+    elif isinstance(post, praw.models.Submission):
         return post.selftext
     else:
         lprint("Attempt to get post text from"
@@ -0,0 +1,154 @@
+'''Bounded thread pools for overlapping Reddit I/O with parsing.
+
+praw fetches lazily and blocks, so the main loops spend most of their
+time waiting on the network.  prefetch() runs those fetches on a few
+threads ahead of the consumer while keeping results in order.
+Pipeline chains several such pools, one per stage of a job.
+'''
+import threading
+from collections import OrderedDict, deque
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+class _Future(object):
+    __slots__ = ('item', 'value', 'error', 'done')
+
+    def __init__(self, item):
+        self.item = item
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+    def get(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _work(tasks, func, closed):
+    while True:
+        future = tasks.get()
+        if future is None:
+            return
+        if not closed.is_set():
+            try:
+                future.value = func(future.item)
+            except Exception as e:
+                future.error = e
+        future.done.set()
+
+
+def prefetch(items, fetch, workers=4, ahead=None):
+    '''Yields fetch(item) for each of items, in order.  Up to ahead
+    (default twice workers) fetches run on workers threads while the
+    caller works on earlier results.  An exception raised by fetch is
+    re-raised when its result is reached.  workers <= 1 fetches inline.'''
+    if workers <= 1:
+        for item in items:
+            yield fetch(item)
+        return
+    ahead = ahead or 2 * workers
+    tasks = Queue()
+    closed = threading.Event()
+    threads = [threading.Thread(target=_work, args=(tasks, fetch, closed))
+               for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    pending = deque()
+    try:
+        for item in items:
+            future = _Future(item)
+            tasks.put(future)
+            pending.append(future)
+            if len(pending) >= ahead:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        # Abandoned by the caller or done: queued fetches are skipped
+        closed.set()
+        for _ in threads:
+            tasks.put(None)
+
+
+class Pipeline(object):
+    '''Runs items through a chain of stages, each on its own bounded
+    thread pool.  stages is a sequence of (name, func, workers); each
+    func gets the previous stage's result (the item itself, for the
+    first stage), and returning None ends that item's trip early.
+
+    At most max_in_flight items are between the first queue and the
+    end of the pipeline at once, so a burst of input cannot pile up
+    behind a slow stage.  depths() reports how many items wait in each
+    stage's queue; peak keeps the deepest each queue has been.'''
+
+    def __init__(self, stages, max_in_flight=16):
+        self.stages = list(stages)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.peak = OrderedDict((name, 0) for name, _, _ in self.stages)
+        self._queues = [Queue() for _ in self.stages]
+        self._done = Queue()
+
+    def depths(self):
+        '''Items waiting in each stage's queue, by stage name'''
+        return OrderedDict((name, queue.qsize()) for (name, _, _), queue
+                           in zip(self.stages, self._queues))
+
+    def _put(self, index, item, value):
+        queue = self._queues[index]
+        queue.put((item, value))
+        name = self.stages[index][0]
+        self.peak[name] = max(self.peak[name], queue.qsize())
+
+    def _stage(self, index):
+        func = self.stages[index][1]
+        last = index == len(self.stages) - 1
+        while True:
+            task = self._queues[index].get()
+            if task is None:
+                return
+            item, value = task
+            try:
+                value = func(value)
+            except Exception as e:
+                self._done.put((item, None, e))
+                continue
+            if last or value is None:
+                self._done.put((item, value, None))
+            else:
+                self._put(index + 1, item, value)
+
+    def run(self, items):
+        '''Yields (item, result, error) for each of items as it leaves
+        the pipeline, in completion order.  error is the exception a
+        stage raised, and result then None.'''
+        threads = []
+        for index, (_, _, workers) in enumerate(self.stages):
+            for _ in range(workers):
+                thread = threading.Thread(target=self._stage, args=(index,))
+                thread.daemon = True
+                thread.start()
+                threads.append((index, thread))
+        try:
+            for item in items:
+                while self.in_flight >= self.max_in_flight:
+                    yield self._finish()
+                self._put(0, item, item)
+                self.in_flight += 1
+            while self.in_flight:
+                yield self._finish()
+        finally:
+            for index, _ in threads:
+                self._queues[index].put(None)
+
+    def _finish(self):
+        done = self._done.get()
+        self.in_flight -= 1
+        return done
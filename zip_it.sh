@@ -1 +1,11 @@
-cd table_genie_api; zip -r --exclude=praw.ini ../table-genie.zip .
\ No newline at end of file
+#!/usr/bin/env bash
+
+# Lambda already provides boto3/botocore, and nothing at runtime needs
+# bytecode caches, package metadata, tests or the benchmarks.
+cd table_genie_api; zip -r -q ../table-genie.zip . \
+    --exclude=praw.ini \
+    --exclude='*.pyc' --exclude='*/__pycache__/*' \
+    --exclude='*.dist-info/*' --exclude='*.egg-info/*' \
+    --exclude='boto3/*' --exclude='botocore/*' \
+    --exclude='*/tests/*' --exclude='benchmarks/*' \
+    --exclude='*.sh' --exclude='*.md' --exclude='.git*'